@@ -0,0 +1,493 @@
+"""Local stand-ins for the Mimir and SpaceONE HTTP APIs used by the plugin.
+
+Mimir:
+    GET  /api/v1/query_range   synthetic OpenCost-shaped matrix per tenant,
+                               an outer "sum by (...) (...)" is evaluated and
+                               opencost_<component>_<cost|usage> selects the
+                               series of one component (cpu, ram, gpu, pv, lb,
+                               idle) without their type label;
+                               optionally behind a simulated query-frontend
+                               results cache (see FakeServerConfig)
+    GET  /api/v1/query         kubecost cluster info, or per-tenant series
+                               counts for "count by (__tenant_id__) (...)"
+                               and "count (...)" (all federation aware)
+
+SpaceONE (HTTP protocol of SpaceONEConnector):
+    POST /agent/list
+    POST /service-account/get
+    POST /service-account/list
+
+Control:
+    GET  /__stats__            request counts, bytes sent per path and
+                               results cache hits/misses
+    POST /__reset__            reset the counters (the results cache is kept)
+"""
+
+import argparse
+import json
+import math
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+__all__ = ["FakeServerConfig", "make_server", "parse_duration"]
+
+_SECONDS_PER_DAY = 86400
+_COST_TYPES = ["CPU", "RAM", "GPU", "PV", "Load Balancer", "idle"]
+_WRITE_BATCH_SIZE = 500
+_SUM_BY_PATTERN = re.compile(r"^sum by \(([^)]*)\) \((.*)\)$", re.DOTALL)
+_COMPONENT_QUERY_PATTERN = re.compile(r"^opencost_(\w+)_(cost|usage)$")
+_COMPONENT_TYPES = {
+    "cpu": "CPU",
+    "ram": "RAM",
+    "gpu": "GPU",
+    "pv": "PV",
+    "lb": "Load Balancer",
+    "idle": "idle",
+}
+_COUNT_PATTERN = re.compile(r"^count(?: by \(__tenant_id__\))? \((.*)\)$", re.DOTALL)
+
+
+class FakeServerConfig:
+    """Shape of the synthetic data and of the simulated Mimir behaviour.
+
+    With results_cache enabled, query_range mimics the Mimir query-frontend:
+    the range is split into split_interval extents aligned to the Unix epoch,
+    and each extent not found in the cache costs query_cost_ms of extra
+    latency. Like Mimir with cache-unaligned-requests disabled, only queries
+    whose start and end are multiples of the step are cached.
+    """
+
+    def __init__(
+        self,
+        series: int = 1000,
+        agents: int = 10,
+        latency_ms: float = 0,
+        clusters: int = 1,
+        results_cache: bool = False,
+        split_interval: float = _SECONDS_PER_DAY,
+        query_cost_ms: float = 0,
+    ):
+        self.series = series
+        self.agents = agents
+        self.latency_ms = latency_ms
+        self.clusters = clusters
+        self.results_cache = results_cache
+        self.split_interval = split_interval
+        self.query_cost_ms = query_cost_ms
+
+
+class _Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = {}
+        self.bytes_sent = {}
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def add(self, path: str, size: int) -> None:
+        with self.lock:
+            self.requests[path] = self.requests.get(path, 0) + 1
+            self.bytes_sent[path] = self.bytes_sent.get(path, 0) + size
+
+    def add_cache_lookups(self, hits: int, misses: int) -> None:
+        with self.lock:
+            self.cache_hits += hits
+            self.cache_misses += misses
+
+    def to_dict(self) -> dict:
+        with self.lock:
+            return {
+                "requests": dict(self.requests),
+                "bytes_sent": dict(self.bytes_sent),
+                "results_cache": {
+                    "hits": self.cache_hits,
+                    "misses": self.cache_misses,
+                },
+            }
+
+    def reset(self) -> None:
+        with self.lock:
+            self.requests.clear()
+            self.bytes_sent.clear()
+            self.cache_hits = 0
+            self.cache_misses = 0
+
+
+class _ResultsCache:
+    """Extents cached by a simulated Mimir query-frontend."""
+
+    def __init__(self, split_interval: float):
+        self.split_interval = split_interval
+        self.lock = threading.Lock()
+        self.extents = set()
+
+    def lookup(self, key: tuple, start: float, end: float, step: float) -> tuple:
+        """Return (hits, misses) over the split extents of the range and cache
+        the missed ones. Unaligned queries bypass the cache entirely.
+        """
+        first = math.floor(start / self.split_interval)
+        last = math.floor(end / self.split_interval)
+        extent_count = last - first + 1
+
+        if start % step or end % step:
+            return 0, extent_count
+
+        hits = 0
+        with self.lock:
+            for index in range(first, last + 1):
+                extent = (key, step, index, max(start, index * self.split_interval))
+                if extent in self.extents:
+                    hits += 1
+                else:
+                    self.extents.add(extent)
+
+        return hits, extent_count - hits
+
+
+def _make_metric(tenant_id: str, index: int, config: FakeServerConfig) -> dict:
+    cost_type = _COST_TYPES[index % len(_COST_TYPES)]
+    metric = {
+        "cluster": f"{tenant_id}-cluster-{index % config.clusters}",
+        "node": f"node-{index % 50}",
+        "type": cost_type,
+    }
+
+    if cost_type in ["CPU", "RAM", "GPU"]:
+        metric["namespace"] = f"namespace-{index % 40}"
+        metric["pod"] = f"pod-{index}"
+        metric["container"] = f"container-{index % 5}"
+    elif cost_type == "PV":
+        metric["namespace"] = f"namespace-{index % 40}"
+        metric["persistentvolume"] = f"pvc-{index}"
+    elif cost_type == "Load Balancer":
+        metric["namespace"] = f"namespace-{index % 40}"
+        metric["service_name"] = f"service-{index}"
+
+    return metric
+
+
+def _make_values(index: int, timestamps: list) -> list:
+    values = []
+    for timestamp in timestamps:
+        day = int(timestamp) // _SECONDS_PER_DAY
+        if (index + day) % 13 == 0:
+            value = "0"
+        else:
+            value = repr(((index * 31 + day * 7) % 1000) / 97.0)
+        values.append([timestamp, value])
+
+    return values
+
+
+def _make_usage_values(index: int, timestamps: list) -> list:
+    return [
+        [timestamp, repr(((index * 17 + int(timestamp) // _SECONDS_PER_DAY) % 64) / 4)]
+        for timestamp in timestamps
+    ]
+
+
+def _iter_series(
+    tenant_ids: list, query: str, timestamps: list, config: FakeServerConfig
+):
+    """Yield (metric, values) of every synthetic series the query selects."""
+    component, kind = None, "cost"
+    if match := _COMPONENT_QUERY_PATTERN.match(query):
+        component, kind = _COMPONENT_TYPES.get(match.group(1)), match.group(2)
+
+    for tenant_id in tenant_ids:
+        for index in range(config.series):
+            metric = _make_metric(tenant_id, index, config)
+            if component is not None and metric.pop("type") != component:
+                continue
+
+            if len(tenant_ids) > 1:
+                metric["__tenant_id__"] = tenant_id
+
+            if kind == "usage":
+                yield metric, _make_usage_values(index, timestamps)
+            else:
+                yield metric, _make_values(index, timestamps)
+
+
+def _aggregate_series(
+    tenant_ids: list,
+    labels: list,
+    query: str,
+    timestamps: list,
+    config: FakeServerConfig,
+) -> list:
+    groups = {}
+    for metric, values in _iter_series(tenant_ids, query, timestamps, config):
+        group_metric = {label: metric[label] for label in labels if label in metric}
+        group = groups.setdefault(
+            tuple(sorted(group_metric.items())),
+            {"metric": group_metric, "values": [0.0] * len(timestamps)},
+        )
+        for position, (_, value) in enumerate(values):
+            group["values"][position] += float(value)
+
+    return [
+        {
+            "metric": group["metric"],
+            "values": [
+                [timestamp, repr(value)]
+                for timestamp, value in zip(timestamps, group["values"])
+            ],
+        }
+        for group in groups.values()
+    ]
+
+
+def _get_step_timestamps(start: float, end: float, step: float) -> list:
+    timestamps = []
+    timestamp = start
+    while timestamp <= end:
+        timestamps.append(int(timestamp) if timestamp.is_integer() else timestamp)
+        timestamp += step
+
+    return timestamps
+
+
+def parse_duration(duration: str) -> float:
+    units = {"s": 1, "m": 60, "h": 3600, "d": _SECONDS_PER_DAY, "w": 7 * 86400}
+    if duration[-1] in units:
+        return float(duration[:-1]) * units[duration[-1]]
+
+    return float(duration)
+
+
+def make_server(
+    config: FakeServerConfig, host: str = "127.0.0.1", port: int = 0
+) -> ThreadingHTTPServer:
+    stats = _Stats()
+    results_cache = _ResultsCache(config.split_interval)
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            params = {key: value[0] for key, value in parse_qs(url.query).items()}
+
+            if url.path == "/__stats__":
+                return self._send_json(url.path, stats.to_dict(), count=False)
+
+            self._sleep()
+            tenant_ids = self.headers.get("X-Scope-OrgID", "").split("|")
+
+            if url.path == "/api/v1/query_range":
+                self._send_matrix(url.path, tenant_ids, params)
+            elif url.path == "/api/v1/query":
+                if count := _COUNT_PATTERN.match(params.get("query", "")):
+                    self._send_series_count(url.path, tenant_ids, count.group(1))
+                else:
+                    self._send_cluster_info(url.path, tenant_ids)
+            else:
+                self._send_json(url.path, {"detail": "Not Found"}, status=404)
+
+        def do_POST(self):
+            url = urlparse(self.path)
+            length = int(self.headers.get("Content-Length") or 0)
+            params = json.loads(self.rfile.read(length) or b"{}")
+
+            if url.path == "/__reset__":
+                stats.reset()
+                return self._send_json(url.path, {}, count=False)
+
+            self._sleep()
+
+            if url.path == "/agent/list":
+                agents = [
+                    {
+                        "service_account_id": f"sa-{index}",
+                        "state": "ENABLED",
+                        "last_accessed_at": "2024-01-01T00:00:00Z",
+                        "options": {"cluster_name": f"cluster-{index}"},
+                    }
+                    for index in range(config.agents)
+                ]
+                self._send_json(
+                    url.path, {"results": agents, "total_count": len(agents)}
+                )
+            elif url.path == "/service-account/get":
+                service_account_id = params["service_account_id"]
+                self._send_json(
+                    url.path,
+                    {
+                        "service_account_id": service_account_id,
+                        "name": f"name-{service_account_id}",
+                    },
+                )
+            elif url.path == "/service-account/list":
+                service_account_ids = []
+                for condition in params.get("query", {}).get("filter", []):
+                    if condition.get("k") == "service_account_id":
+                        service_account_ids = condition["v"]
+
+                results = [
+                    {"service_account_id": sa_id, "name": f"name-{sa_id}"}
+                    for sa_id in service_account_ids
+                ]
+                self._send_json(
+                    url.path, {"results": results, "total_count": len(results)}
+                )
+            else:
+                self._send_json(url.path, {"detail": "Not Found"}, status=404)
+
+        def _sleep(self):
+            if config.latency_ms:
+                time.sleep(config.latency_ms / 1000)
+
+        def _send_json(self, path, body, status=200, count=True):
+            data = json.dumps(body).encode("utf-8")
+
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+            if count:
+                stats.add(path, len(data))
+
+        def _send_cluster_info(self, path, tenant_ids):
+            federated = len(tenant_ids) > 1
+            result = []
+            for tenant_id in tenant_ids:
+                metric = {"provisioner": "EKS", "region": "ap-northeast-2"}
+                if federated:
+                    metric["__tenant_id__"] = tenant_id
+                result.append({"metric": metric, "value": [time.time(), "1"]})
+
+            self._send_json(
+                path,
+                {
+                    "status": "success",
+                    "data": {"resultType": "vector", "result": result},
+                },
+            )
+
+        def _send_series_count(self, path, tenant_ids, query):
+            federated = len(tenant_ids) > 1
+            result = []
+            for tenant_id in tenant_ids:
+                if sum_by := _SUM_BY_PATTERN.match(query):
+                    labels = [label.strip() for label in sum_by.group(1).split(",")]
+                    series_count = len(
+                        _aggregate_series(
+                            [tenant_id], labels, sum_by.group(2), [0], config
+                        )
+                    )
+                else:
+                    series_count = sum(
+                        1 for _ in _iter_series([tenant_id], query, [], config)
+                    )
+
+                metric = {"__tenant_id__": tenant_id} if federated else {}
+                result.append(
+                    {"metric": metric, "value": [time.time(), str(series_count)]}
+                )
+
+            self._send_json(
+                path,
+                {
+                    "status": "success",
+                    "data": {"resultType": "vector", "result": result},
+                },
+            )
+
+        def _send_matrix(self, path, tenant_ids, params):
+            start, end = float(params["start"]), float(params["end"])
+            step = parse_duration(params.get("step", "1d"))
+            timestamps = _get_step_timestamps(start, end, step)
+
+            if config.results_cache:
+                key = ("|".join(tenant_ids), params.get("query", ""))
+                hits, misses = results_cache.lookup(key, start, end, step)
+                stats.add_cache_lookups(hits, misses)
+                if misses and config.query_cost_ms:
+                    time.sleep(misses * config.query_cost_ms / 1000)
+
+            # Write the body in chunks so that the server itself never holds a
+            # whole month of synthetic series in memory.
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+
+            size = self._write_chunk(
+                '{"status":"success","data":{"resultType":"matrix","result":['
+            )
+
+            if sum_by := _SUM_BY_PATTERN.match(params.get("query", "")):
+                labels = [label.strip() for label in sum_by.group(1).split(",")]
+                if len(tenant_ids) > 1:
+                    labels.append("__tenant_id__")
+
+                series = _aggregate_series(
+                    tenant_ids, labels, sum_by.group(2), timestamps, config
+                )
+                size += self._write_chunk(",".join(json.dumps(s) for s in series))
+                size += self._write_chunk("]}}")
+                self.wfile.write(b"0\r\n\r\n")
+                stats.add(path, size)
+                return
+
+            separator, batch = "", []
+            for metric, values in _iter_series(
+                tenant_ids, params.get("query", ""), timestamps, config
+            ):
+                batch.append(json.dumps({"metric": metric, "values": values}))
+                if len(batch) == _WRITE_BATCH_SIZE:
+                    size += self._write_chunk(separator + ",".join(batch))
+                    separator, batch = ",", []
+
+            if batch:
+                size += self._write_chunk(separator + ",".join(batch))
+
+            size += self._write_chunk("]}}")
+            self.wfile.write(b"0\r\n\r\n")
+            stats.add(path, size)
+
+        def _write_chunk(self, text: str) -> int:
+            data = text.encode("utf-8")
+            self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+            return len(data)
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=9009)
+    parser.add_argument("--series", type=int, default=1000)
+    parser.add_argument("--agents", type=int, default=10)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--results-cache", action="store_true")
+    parser.add_argument("--split-interval", default="1d")
+    parser.add_argument("--query-cost-ms", type=float, default=0)
+    args = parser.parse_args()
+
+    config = FakeServerConfig(
+        series=args.series,
+        agents=args.agents,
+        latency_ms=args.latency_ms,
+        results_cache=args.results_cache,
+        split_interval=parse_duration(args.split_interval),
+        query_cost_ms=args.query_cost_ms,
+    )
+    server = make_server(config, port=args.port)
+    print(f"Listening on http://127.0.0.1:{server.server_address[1]}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,271 @@
+"""End-to-end throughput benchmark for the OpenCost cost data source plugin.
+
+Starts the fake Mimir/SpaceONE server from benchmark.fake_server in a separate
+process and drives CostManager.get_data and JobManager.get_tasks against it.
+Every scenario runs in a freshly spawned process, so the reported peak RSS
+belongs to the plugin code path alone.
+
+Examples (from the repository root, with the plugin requirements installed):
+
+    python -m benchmark.run --series 20000
+    python -m benchmark.run --options '{"stream_response": true}'
+    python -m benchmark.run --results-cache --query-cost-ms 20 --repeat 3
+    python -m benchmark.run --save-baseline benchmark/baseline.json
+    python -m benchmark.run --compare benchmark/baseline.json --tolerance 0.15
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import statistics
+import sys
+import time
+import urllib.request
+
+from benchmark.fake_server import FakeServerConfig, make_server, parse_duration
+
+__all__ = ["run_scenario", "compare_results"]
+
+_SRC_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "src")
+_SCENARIOS = ["cost", "tasks"]
+
+# Metric name -> True if a larger value is a regression.
+_COMPARED_METRICS = {
+    "wall_time_s": True,
+    "peak_rss_mb": True,
+    "total_requests": True,
+    "rows_per_sec": False,
+}
+
+
+def _serve(config: FakeServerConfig, port_queue) -> None:
+    server = make_server(config)
+    port_queue.put(server.server_address[1])
+    server.serve_forever()
+
+
+def _http(endpoint: str, path: str, method: str = "GET") -> dict:
+    request = urllib.request.Request(f"{endpoint}{path}", method=method)
+    with urllib.request.urlopen(request) as response:
+        return json.loads(response.read() or b"{}")
+
+
+def _make_secret_data(endpoint: str) -> dict:
+    return {
+        "mimir_endpoint": endpoint,
+        "promql": "opencost_cost",
+        "cluster_info_query": "kubecost_cluster_info",
+        "spaceone_endpoint": endpoint,
+        "spaceone_client_secret": "benchmark",
+    }
+
+
+def _run_cost(endpoint: str, options: dict, args: dict) -> dict:
+    from plugin.manager.cost_manager import CostManager
+
+    task_options = {"start": args["month"], "service_account_id": "sa-0"}
+
+    rows, pages = 0, 0
+    for page in CostManager().get_data(
+        "domain-benchmark", options, _make_secret_data(endpoint), None, task_options
+    ):
+        rows += len(page["results"])
+        pages += 1
+
+    return {"rows": rows, "pages": pages}
+
+
+def _run_tasks(endpoint: str, options: dict, args: dict) -> dict:
+    from plugin.manager.job_manager import JobManager
+
+    response = JobManager().get_tasks(
+        "domain-benchmark",
+        options,
+        _make_secret_data(endpoint),
+        None,
+        args["tasks_start"],
+        None,
+    )
+
+    return {"rows": len(response["tasks"]), "pages": 1}
+
+
+def _scenario_worker(name: str, endpoint: str, options: dict, args: dict, queue):
+    sys.path.insert(0, _SRC_DIR)
+
+    runner = {"cost": _run_cost, "tasks": _run_tasks}[name]
+
+    started_at = time.perf_counter()
+    result = runner(endpoint, options, args)
+    wall_time = time.perf_counter() - started_at
+
+    result["wall_time_s"] = wall_time
+    result["rows_per_sec"] = result["rows"] / wall_time if wall_time else 0.0
+    result["peak_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    queue.put(result)
+
+
+def run_scenario(name: str, endpoint: str, options: dict, args: dict) -> dict:
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+
+    _http(endpoint, "/__reset__", method="POST")
+
+    process = context.Process(
+        target=_scenario_worker, args=(name, endpoint, options, args, queue)
+    )
+    process.start()
+    result = queue.get()
+    process.join()
+
+    server_stats = _http(endpoint, "/__stats__")
+    result["requests"] = server_stats["requests"]
+    result["total_requests"] = sum(server_stats["requests"].values())
+    result["bytes_received"] = sum(server_stats["bytes_sent"].values())
+
+    cache_stats = server_stats["results_cache"]
+    if lookups := cache_stats["hits"] + cache_stats["misses"]:
+        result["cache_hit_ratio"] = cache_stats["hits"] / lookups
+
+    return result
+
+
+def _summarize(runs: list) -> dict:
+    summary = dict(runs[-1])
+    summary["wall_time_s"] = statistics.median(run["wall_time_s"] for run in runs)
+    summary["rows_per_sec"] = statistics.median(run["rows_per_sec"] for run in runs)
+    summary["peak_rss_mb"] = max(run["peak_rss_mb"] for run in runs)
+
+    return summary
+
+
+def compare_results(baseline: dict, current: dict, tolerance: float) -> list:
+    regressions = []
+    for scenario, metrics in current.items():
+        baseline_metrics = baseline.get(scenario)
+        if not baseline_metrics:
+            continue
+
+        for metric, higher_is_worse in _COMPARED_METRICS.items():
+            before, after = baseline_metrics.get(metric), metrics.get(metric)
+            if not before or after is None:
+                continue
+
+            change = (after - before) / before
+            if (higher_is_worse and change > tolerance) or (
+                not higher_is_worse and -change > tolerance
+            ):
+                regressions.append(
+                    f"{scenario}.{metric}: {before:.3f} -> {after:.3f} ({change:+.1%})"
+                )
+
+    return regressions
+
+
+def _print_results(results: dict) -> None:
+    header = f"{'scenario':<10}{'rows':>10}{'pages':>8}{'wall(s)':>10}{'rows/s':>12}{'rss(MB)':>10}{'requests':>10}{'MB recv':>10}"
+    print(header)
+    print("-" * len(header))
+    for scenario, metrics in results.items():
+        print(
+            f"{scenario:<10}{metrics['rows']:>10}{metrics['pages']:>8}"
+            f"{metrics['wall_time_s']:>10.3f}{metrics['rows_per_sec']:>12.0f}"
+            f"{metrics['peak_rss_mb']:>10.1f}{metrics['total_requests']:>10}"
+            f"{metrics['bytes_received'] / 1024 / 1024:>10.1f}"
+        )
+        print(f"{'':<10}{json.dumps(metrics['requests'], sort_keys=True)}")
+        if "cache_hit_ratio" in metrics:
+            print(f"{'':<10}results cache hit ratio {metrics['cache_hit_ratio']:.1%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.splitlines()[0],
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("--scenario", choices=_SCENARIOS + ["all"], default="all")
+    parser.add_argument("--series", type=int, default=5000)
+    parser.add_argument("--agents", type=int, default=50)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument(
+        "--results-cache",
+        action="store_true",
+        help="simulate the Mimir query-frontend results cache; it is kept "
+        "across --repeat runs, so later runs measure repeated syncs",
+    )
+    parser.add_argument("--split-interval", default="1d")
+    parser.add_argument(
+        "--query-cost-ms",
+        type=float,
+        default=0,
+        help="extra latency per split interval missing from the results cache",
+    )
+    parser.add_argument("--month", default="2024-01")
+    parser.add_argument("--tasks-start", default="2024-01")
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--options", default="{}", help="plugin options as JSON")
+    parser.add_argument("--save-baseline", metavar="PATH")
+    parser.add_argument("--compare", metavar="PATH")
+    parser.add_argument("--tolerance", type=float, default=0.15)
+    args = parser.parse_args()
+
+    config = FakeServerConfig(
+        series=args.series,
+        agents=args.agents,
+        latency_ms=args.latency_ms,
+        results_cache=args.results_cache,
+        split_interval=parse_duration(args.split_interval),
+        query_cost_ms=args.query_cost_ms,
+    )
+    context = multiprocessing.get_context("spawn")
+    port_queue = context.Queue()
+    server_process = context.Process(
+        target=_serve, args=(config, port_queue), daemon=True
+    )
+    server_process.start()
+    endpoint = f"http://127.0.0.1:{port_queue.get()}"
+
+    options = {"resource_group": "DOMAIN", **json.loads(args.options)}
+    scenario_args = {"month": args.month, "tasks_start": args.tasks_start}
+    scenarios = _SCENARIOS if args.scenario == "all" else [args.scenario]
+
+    try:
+        results = {
+            scenario: _summarize(
+                [
+                    run_scenario(scenario, endpoint, options, scenario_args)
+                    for _ in range(args.repeat)
+                ]
+            )
+            for scenario in scenarios
+        }
+    finally:
+        server_process.terminate()
+
+    _print_results(results)
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(
+                {"config": vars(args), "results": results}, f, indent=2, sort_keys=True
+            )
+        print(f"\nBaseline saved to {args.save_baseline}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+
+        regressions = compare_results(baseline, results, args.tolerance)
+        if regressions:
+            print(f"\nRegressions beyond {args.tolerance:.0%}:")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+
+        print(f"\nNo regressions beyond {args.tolerance:.0%}.")
+
+
+if __name__ == "__main__":
+    main()
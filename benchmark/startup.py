@@ -0,0 +1,100 @@
+"""Cold-start benchmark: import time and baseline RSS of plugin.main.
+
+Each sample imports plugin.main in a fresh interpreter, the way a new plugin
+pod does, and records the wall time of the import, the peak RSS afterwards
+and which heavy third-party modules ended up loaded.
+
+Examples (from the repository root, with the plugin requirements installed):
+
+    python -m benchmark.startup
+    python -m benchmark.startup --preload pandas    # previous import graph
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+__all__ = ["measure_startup"]
+
+_SRC_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "src")
+_WATCHED_MODULES = ["pandas", "numpy", "prometheus_client", "ijson", "requests"]
+
+_PROBE = """
+import json, resource, sys, time
+
+from spaceone.core import config
+
+config.init_conf(package="plugin")
+
+started_at = time.perf_counter()
+for module in {preload!r}:
+    __import__(module)
+import plugin.main
+import_time = time.perf_counter() - started_at
+
+print(json.dumps({{
+    "import_time_s": import_time,
+    "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    "loaded": [module for module in {watched!r} if module in sys.modules],
+}}))
+"""
+
+
+def _run_probe(preload: list) -> dict:
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [_SRC_DIR, env.get("PYTHONPATH")]))
+
+    output = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            _PROBE.format(preload=preload, watched=_WATCHED_MODULES),
+        ],
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def measure_startup(repeat: int = 5, preload: list = None) -> dict:
+    samples = [_run_probe(preload or []) for _ in range(repeat)]
+
+    return {
+        "import_time_s": statistics.median(s["import_time_s"] for s in samples),
+        "peak_rss_mb": statistics.median(s["peak_rss_mb"] for s in samples),
+        "loaded": samples[-1]["loaded"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.splitlines()[0],
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument(
+        "--preload",
+        action="append",
+        default=[],
+        metavar="MODULE",
+        help="import MODULE before plugin.main (e.g. pandas to compare against it)",
+    )
+    args = parser.parse_args()
+
+    result = measure_startup(args.repeat, args.preload)
+
+    print(f"{'import(s)':>10}{'rss(MB)':>10}  loaded")
+    print(
+        f"{result['import_time_s']:>10.3f}{result['peak_rss_mb']:>10.1f}"
+        f"  {', '.join(result['loaded'])}"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,395 @@
+import asyncio
+import logging
+import time
+from typing import Dict, List, Union
+
+import requests
+
+from ..lib import async_http, metrics
+from ..lib.series import Series
+from .mimir_connector import BaseMimirConnector
+
+__all__ = ["AsyncMimirConnector"]
+
+_LOGGER = logging.getLogger("spaceone")
+
+_DEFAULT_MIMIR_CONCURRENCY = 8
+
+
+class AsyncMimirConnector(BaseMimirConnector):
+    """MimirConnector counterpart whose query methods are coroutines.
+
+    Requests go through pooled aiohttp sessions and a semaphore per Mimir
+    endpoint, while retries, range splitting, decoding and cluster info caching
+    are shared with MimirConnector. Responses are decoded in the loop's default
+    executor so the shared event loop keeps serving other requests. Run the
+    coroutines with async_http.run().
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.options = {}
+        self.concurrency = _DEFAULT_MIMIR_CONCURRENCY
+
+    def init_client(self, options: dict, secret_data: dict, schema: str = None) -> None:
+        super().init_client(options, secret_data, schema)
+        self.options = options
+        self.concurrency = int(
+            options.get("mimir_concurrency", _DEFAULT_MIMIR_CONCURRENCY)
+        )
+
+    async def get_promql_response(
+        self,
+        prometheus_query_range_endpoint: str,
+        start: str,
+        service_account_id: str,
+        promql: str,
+        end: str = None,
+    ) -> Union[List[Series], None]:
+        headers = self._make_headers(service_account_id)
+
+        time_windows = self._make_time_windows(start, end=end)
+        if len(time_windows) == 1:
+            return await self._query_range(
+                prometheus_query_range_endpoint,
+                headers,
+                promql,
+                *time_windows[0],
+            )
+
+        window_results = await asyncio.gather(
+            *(
+                self._query_range(
+                    prometheus_query_range_endpoint,
+                    headers,
+                    promql,
+                    window_start,
+                    window_end,
+                )
+                for window_start, window_end in time_windows
+            )
+        )
+
+        return [series for result in window_results for series in result or []]
+
+    async def get_sharded_promql_response(
+        self,
+        prometheus_query_range_endpoint: str,
+        start: str,
+        service_account_id: str,
+        promql: str,
+        query_shard: dict,
+        end: str = None,
+    ) -> List[Series]:
+        headers = self._make_headers(service_account_id)
+
+        # The endpoint semaphore bounds how many shards are in flight at once.
+        shard_results = await asyncio.gather(
+            *(
+                self._query_range(
+                    prometheus_query_range_endpoint,
+                    headers,
+                    shard_promql,
+                    shard_start,
+                    shard_end,
+                )
+                for shard_promql, shard_start, shard_end in self._make_query_shards(
+                    start, promql, query_shard, end
+                )
+            )
+        )
+
+        return [series for result in shard_results for series in result or []]
+
+    async def get_component_promql_response(
+        self,
+        prometheus_query_range_endpoint: str,
+        start: str,
+        service_account_id: str,
+        component_queries: List[dict],
+        end: str = None,
+    ) -> List[Series]:
+        headers = self._make_headers(service_account_id)
+        queries = self._make_component_range_queries(
+            component_queries, self._make_time_windows(start, end=end)
+        )
+
+        query_results = await asyncio.gather(
+            *(
+                self._query_range(
+                    prometheus_query_range_endpoint,
+                    headers,
+                    promql,
+                    window_start,
+                    window_end,
+                )
+                for _, promql, window_start, window_end in queries
+            )
+        )
+
+        responses = {}
+        for (query_key, *_), result in zip(queries, query_results):
+            responses.setdefault(query_key, []).extend(result or [])
+
+        return self._join_component_series(component_queries, responses)
+
+    async def _query_range(
+        self,
+        prometheus_query_range_endpoint: str,
+        headers: dict,
+        promql: str,
+        start_unix_timestamp: str,
+        end_unix_timestamp: str,
+    ) -> Union[List[Series], None]:
+        params = self._make_query_range_params(
+            promql, start_unix_timestamp, end_unix_timestamp
+        )
+
+        try:
+            response = await self._get_with_retry(
+                prometheus_query_range_endpoint, headers=headers, params=params
+            )
+
+            if self._is_query_limit_error(response):
+                return await self._split_query_range(
+                    prometheus_query_range_endpoint,
+                    headers,
+                    promql,
+                    start_unix_timestamp,
+                    end_unix_timestamp,
+                    reason=self._get_error_reason(response),
+                )
+
+            return await asyncio.get_running_loop().run_in_executor(
+                None,
+                self._decode_query_range_response,
+                prometheus_query_range_endpoint,
+                headers,
+                response,
+            )
+        except requests.ConnectionError as conn_err:
+            _LOGGER.error(
+                f"[get_promql_response] connection error occurred: {conn_err}"
+            )
+            self._add_failed_range(
+                headers, start_unix_timestamp, end_unix_timestamp, conn_err
+            )
+        except requests.ReadTimeout as timeout_err:
+            return await self._split_query_range(
+                prometheus_query_range_endpoint,
+                headers,
+                promql,
+                start_unix_timestamp,
+                end_unix_timestamp,
+                reason=str(timeout_err),
+            )
+        except requests.HTTPError as http_err:
+            self._log_query_range_http_error("get_promql_response", http_err)
+            self._add_failed_range(
+                headers, start_unix_timestamp, end_unix_timestamp, http_err
+            )
+        except Exception as err:
+            _LOGGER.error(f"[get_promql_response] error occurred: {err}")
+            self._add_failed_range(
+                headers, start_unix_timestamp, end_unix_timestamp, err
+            )
+
+    async def _split_query_range(
+        self,
+        prometheus_query_range_endpoint: str,
+        headers: dict,
+        promql: str,
+        start_unix_timestamp: str,
+        end_unix_timestamp: str,
+        reason: str,
+    ) -> List[Series]:
+        sub_results = await asyncio.gather(
+            *(
+                self._query_range(
+                    prometheus_query_range_endpoint, headers, promql, sub_start, sub_end
+                )
+                for sub_start, sub_end in self._get_split_ranges(
+                    headers, start_unix_timestamp, end_unix_timestamp, reason
+                )
+            )
+        )
+
+        return [series for result in sub_results for series in result or []]
+
+    async def get_kubecost_cluster_info(
+        self,
+        prometheus_query_endpoint: str,
+        start: str,
+        service_account_id: str,
+        secret_data: dict,
+    ) -> dict:
+        cluster_info_query = secret_data["cluster_info_query"]
+        cache_key = (prometheus_query_endpoint, service_account_id, cluster_info_query)
+        if cluster_info := self._get_cached_cluster_info(cache_key):
+            return cluster_info
+
+        headers = self._make_headers(service_account_id)
+        try:
+            response = await self._get_with_retry(
+                prometheus_query_endpoint,
+                headers=headers,
+                params={"query": cluster_info_query},
+            )
+
+            return self._parse_cluster_info(
+                prometheus_query_endpoint, headers, cache_key, start, response
+            )
+        except requests.HTTPError as http_err:
+            _LOGGER.error(
+                f"[get_kubecost_cluster_info] HTTP error occurred: {http_err}"
+            )
+            metrics.count_error(self.metric_route, service_account_id, "mimir", "query")
+        except Exception as err:
+            _LOGGER.error(f"[get_kubecost_cluster_info] error occurred: {err}")
+            metrics.count_error(self.metric_route, service_account_id, "mimir", "query")
+
+    async def list_kubecost_cluster_infos(
+        self,
+        prometheus_query_endpoint: str,
+        service_account_ids: List[str],
+        secret_data: dict,
+    ) -> Dict[str, dict]:
+        cluster_info_query = secret_data["cluster_info_query"]
+
+        async def _query_batch(tenant_ids: List[str]) -> Union[dict, None]:
+            headers = self._make_federated_headers(tenant_ids)
+            try:
+                response = await self._get_with_retry(
+                    prometheus_query_endpoint,
+                    headers=headers,
+                    params={"query": cluster_info_query},
+                )
+                response.raise_for_status()
+                self._observe_response(prometheus_query_endpoint, headers, response)
+                return response.json()
+            except Exception as err:
+                _LOGGER.error(f"[list_kubecost_cluster_infos] error occurred: {err}")
+                metrics.count_error(
+                    self.metric_route, headers["X-Scope-OrgID"], "mimir", "query"
+                )
+
+        tenant_batches = self._make_tenant_batches(service_account_ids)
+        responses = await asyncio.gather(
+            *(_query_batch(tenant_ids) for tenant_ids in tenant_batches)
+        )
+
+        cluster_infos = {}
+        for tenant_ids, response_json in zip(tenant_batches, responses):
+            if response_json is not None:
+                self._merge_cluster_infos(cluster_infos, tenant_ids, response_json)
+
+        self._cache_cluster_infos(
+            prometheus_query_endpoint, cluster_info_query, cluster_infos
+        )
+
+        return cluster_infos
+
+    async def list_series_counts(
+        self,
+        prometheus_query_endpoint: str,
+        service_account_ids: List[str],
+        promql: str,
+    ) -> Dict[str, int]:
+        count_query = self._make_series_count_query(promql)
+
+        async def _query_batch(tenant_ids: List[str], query: str) -> dict:
+            headers = self._make_federated_headers(tenant_ids)
+            try:
+                response = await self._get_with_retry(
+                    prometheus_query_endpoint,
+                    headers=headers,
+                    params={"query": query},
+                )
+                response.raise_for_status()
+                self._observe_response(prometheus_query_endpoint, headers, response)
+                return response.json()
+            except Exception as err:
+                _LOGGER.error(f"[list_series_counts] error occurred: {err}")
+                metrics.count_error(
+                    self.metric_route, headers["X-Scope-OrgID"], "mimir", "query"
+                )
+                raise
+
+        tenant_batches = self._make_tenant_batches(service_account_ids)
+        responses = await asyncio.gather(
+            *(_query_batch(tenant_ids, count_query) for tenant_ids in tenant_batches),
+            return_exceptions=True,
+        )
+
+        series_counts, rejected_tenant_ids = {}, []
+        for tenant_ids, response_json in zip(tenant_batches, responses):
+            if isinstance(response_json, requests.HTTPError) and len(tenant_ids) > 1:
+                rejected_tenant_ids.extend(tenant_ids)
+            elif not isinstance(response_json, Exception):
+                self._merge_series_counts(series_counts, tenant_ids, response_json)
+
+        # Without tenant federation in Mimir the batches fail, so their tenants
+        # are counted one by one; the endpoint semaphore bounds the queries.
+        tenant_count_query = self._make_series_count_query(promql, by_tenant=False)
+        responses = await asyncio.gather(
+            *(
+                _query_batch([tenant_id], tenant_count_query)
+                for tenant_id in rejected_tenant_ids
+            ),
+            return_exceptions=True,
+        )
+        for tenant_id, response_json in zip(rejected_tenant_ids, responses):
+            if not isinstance(response_json, Exception):
+                self._merge_series_counts(series_counts, [tenant_id], response_json)
+
+        return series_counts
+
+    async def _get_with_retry(
+        self, url: str, headers: dict, **kwargs
+    ) -> requests.Response:
+        max_retries = self._get_max_retries()
+
+        for attempt in range(max_retries + 1):
+            is_last_attempt = attempt == max_retries
+
+            try:
+                response = await self._get(url, headers, **kwargs)
+            except requests.ConnectionError as conn_err:
+                if is_last_attempt:
+                    raise
+
+                await asyncio.sleep(
+                    self._get_connection_retry_delay(conn_err, attempt, headers)
+                )
+                continue
+
+            if not self._should_retry(response, is_last_attempt):
+                return response
+
+            await asyncio.sleep(
+                self._get_status_retry_delay(
+                    url, response, attempt, max_retries, headers
+                )
+            )
+
+    async def _get(self, url: str, headers: dict, **kwargs) -> requests.Response:
+        session = async_http.get_async_session(url, self.options)
+
+        async with async_http.get_semaphore(url, self.concurrency):
+            started_at = time.perf_counter()
+            status = "error"
+            try:
+                response = await async_http.request(
+                    session, "GET", url, timeout=self.timeout, headers=headers, **kwargs
+                )
+                status = response.status_code
+                return response
+            finally:
+                metrics.observe_request(
+                    self.metric_route,
+                    self._get_tenant(headers),
+                    "mimir",
+                    self._get_api_name(url),
+                    time.perf_counter() - started_at,
+                    status,
+                )
@@ -0,0 +1,66 @@
+import asyncio
+import logging
+import time
+
+from ..lib import async_http, metrics
+from .spaceone_connector import SpaceONEConnector
+
+__all__ = ["AsyncSpaceONEConnector"]
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class AsyncSpaceONEConnector(SpaceONEConnector):
+    """SpaceONEConnector whose API methods return coroutines.
+
+    The list/get helpers of SpaceONEConnector return whatever dispatch() returns,
+    so they become awaitable as-is. HTTP endpoints use pooled aiohttp sessions;
+    the gRPC client is blocking and runs in the event loop's executor.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.options = {}
+
+    def init_client(self, options: dict, secret_data: dict, schema: str = None) -> None:
+        super().init_client(options, secret_data, schema)
+        self.options = options
+
+    async def dispatch(self, method: str = None, params: dict = None, **kwargs):
+        started_at = time.perf_counter()
+        status = "error"
+        try:
+            if self.protocol == "grpc":
+                response = await asyncio.get_running_loop().run_in_executor(
+                    None, lambda: self.grpc_client.dispatch(method, params, **kwargs)
+                )
+            else:
+                response = await self.request(method, params, **kwargs)
+
+            status = "ok"
+            return response
+        except Exception:
+            metrics.count_error(
+                self.metric_route, self.metric_tenant, "spaceone", method
+            )
+            raise
+        finally:
+            metrics.observe_request(
+                self.metric_route,
+                self.metric_tenant,
+                "spaceone",
+                method,
+                time.perf_counter() - started_at,
+                status,
+            )
+
+    async def request(self, method, params, **kwargs):
+        url = f"{self.endpoint}/{self._convert_method_to_snake_case(method)}"
+
+        headers = self._make_request_header(self.token, **kwargs)
+        session = async_http.get_async_session(self.endpoint, self.options)
+        response = await async_http.request(
+            session, "POST", url, timeout=self.timeout, json=params, headers=headers
+        )
+
+        return self._parse_response(method, response)
@@ -1,19 +1,96 @@
+import calendar
 import logging
-from typing import Generator, List, Union
+import random
+import re
+import time
+from array import array
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from itertools import islice
+from typing import Dict, Generator, Iterable, List, Tuple, Union
 
-import pandas as pd
+import ijson
 import requests
-from pandas._libs.tslibs.offsets import MonthEnd
 from spaceone.core.connector import BaseConnector
-from spaceone.core.error import ERROR_REQUIRED_PARAMETER
+from spaceone.core.error import ERROR_INVALID_PARAMETER, ERROR_REQUIRED_PARAMETER
+
+from ..lib import metrics
+from ..lib.cache import TTLCache
+from ..lib.http_session import get_session, get_timeout
+from ..lib.series import Series
 
 _LOGGER = logging.getLogger("spaceone")
-_PAGE_SIZE = 1000
+_DEFAULT_PAGE_MAX_ROWS = 10000
+_DEFAULT_PAGE_MAX_BYTES = 2 * 1024 * 1024
+_ROW_BASE_BYTES = 200
+_STREAM_CHUNK_SIZE = 64 * 1024
+_RESULT_ITEM_PREFIX = "data.result.item"
+_SHARD_PLACEHOLDER = "$shard"
+# The placeholder and a comma that follows it, so "{$shard, a="b"}" stays valid.
+_SHARD_PLACEHOLDER_PATTERN = re.compile(r"\$shard(?:\s*,\s*)?")
+_DEFAULT_SHARD_WORKERS = 4
+_DEFAULT_COMPONENT_WORKERS = 8
+_COMPONENT_QUERY_KINDS = ["cost", "usage"]
+# Labels ignored when matching usage series to cost series.
+_COMPONENT_JOIN_IGNORED_LABELS = ["__name__", "type"]
+_SECONDS_PER_DAY = 86400
+_DEFAULT_QUERY_STEP = "1d"
+_DURATION_PATTERN = re.compile(r"^(\d+)([smhdw]?)$")
+_DURATION_UNITS = {
+    "": 1,
+    "s": 1,
+    "m": 60,
+    "h": 3600,
+    "d": _SECONDS_PER_DAY,
+    "w": 7 * _SECONDS_PER_DAY,
+}
+_DEFAULT_MAX_RETRIES = 3
+_DEFAULT_BACKOFF_BASE = 1.0
+_DEFAULT_BACKOFF_MAX = 30.0
+_RETRY_STATUS_CODES = [429, 500, 502, 503, 504]
+# Only error bodies naming a query limit or a timeout are worth splitting the
+# range for; other errors, such as invalid PromQL, fail the same way on any range.
+_QUERY_LIMIT_PATTERN = re.compile(
+    r"too many samples|maximum number of|max number of|exceed(?:ed|s)|time[d-]? ?out",
+    re.IGNORECASE,
+)
+_ERROR_REASON_LENGTH = 200
+_DEFAULT_CLUSTER_INFO_CACHE_TTL = 600
+_CLUSTER_INFO_BATCH_SIZE = 50
+_SERIES_COUNT_WORKERS = 4
+_TENANT_ID_LABEL = "__tenant_id__"
+_AGGREGATION_LABELS = {
+    "cluster": ["cluster"],
+    "node": ["cluster", "node"],
+    "namespace": ["cluster", "namespace"],
+    "pod": ["cluster", "node", "namespace", "pod"],
+    "container": [
+        "cluster",
+        "node",
+        "namespace",
+        "pod",
+        "container",
+        "persistentvolume",
+        "service_name",
+    ],
+}
+# Labels kept at every aggregation level, the cost type decides usage_type.
+_AGGREGATION_BASE_LABELS = ["type"]
+
+_CLUSTER_INFO_CACHE = TTLCache(maxsize=1024)
+
+__all__ = ["BaseMimirConnector", "MimirConnector"]
 
-__all__ = ["MimirConnector"]
 
+class BaseMimirConnector(BaseConnector):
+    """Settings, query building and response decoding shared by the connectors.
+
+    MimirConnector sends its queries with requests and AsyncMimirConnector with
+    aiohttp coroutines, so neither inherits the other's request methods.
+    """
 
-class MimirConnector(BaseConnector):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
@@ -28,6 +105,69 @@ class MimirConnector(BaseConnector):
         self.default_vars = None
         self.client = None
 
+        self.session = None
+        self.timeout = get_timeout()
+        self.query_retry = {}
+        self.failed_ranges = []
+        self.cluster_info_cache_ttl = _DEFAULT_CLUSTER_INFO_CACHE_TTL
+        self.metric_route = ""
+        self.query_step = _DURATION_UNITS["d"]
+        self.query_split_interval = None
+        self.component_workers = _DEFAULT_COMPONENT_WORKERS
+
+    def init_client(self, options: dict, secret_data: dict, schema: str = None) -> None:
+        if "mimir_endpoint" not in secret_data:
+            raise ERROR_REQUIRED_PARAMETER(key="secret_data.mimir_endpoint")
+
+        self.mimir_endpoint = secret_data["mimir_endpoint"]
+        self.session = get_session(self.mimir_endpoint, options)
+        self.timeout = get_timeout(options)
+        self.query_retry = options.get("query_retry", {})
+        self.failed_ranges = []
+        self.cluster_info_cache_ttl = options.get(
+            "cluster_info_cache_ttl", _DEFAULT_CLUSTER_INFO_CACHE_TTL
+        )
+        self.query_step, self.query_split_interval = self._get_query_intervals(options)
+        self.component_workers = int(
+            options.get("component_workers", _DEFAULT_COMPONENT_WORKERS)
+        )
+
+    @classmethod
+    def _get_query_intervals(cls, options: dict) -> Tuple[int, Union[int, None]]:
+        query_step = cls._parse_duration(
+            "options.query_step", options.get("query_step", _DEFAULT_QUERY_STEP)
+        )
+        if _SECONDS_PER_DAY % query_step:
+            raise ERROR_INVALID_PARAMETER(
+                key="options.query_step",
+                reason="The step must evenly divide a day, e.g. 1h, 6h or 1d.",
+            )
+
+        query_split_interval = options.get("query_split_interval")
+        if query_split_interval is None:
+            return query_step, None
+
+        query_split_interval = cls._parse_duration(
+            "options.query_split_interval", query_split_interval
+        )
+        if query_split_interval % query_step:
+            raise ERROR_INVALID_PARAMETER(
+                key="options.query_split_interval",
+                reason="The split interval must be a multiple of options.query_step.",
+            )
+
+        return query_step, query_split_interval
+
+    @staticmethod
+    def _parse_duration(key: str, duration: Union[str, int]) -> int:
+        match = _DURATION_PATTERN.match(str(duration))
+        if not match or not int(match.group(1)):
+            raise ERROR_INVALID_PARAMETER(
+                key=key, reason="Use a positive duration such as 30m, 6h or 1d."
+            )
+
+        return int(match.group(1)) * _DURATION_UNITS[match.group(2)]
+
     def create_session(
         self,
         domain_id: str,
@@ -49,53 +189,943 @@ class MimirConnector(BaseConnector):
         self.field_mapper = options.get("field_mapper", None)
         self.default_vars = options.get("default_vars", None)
 
-    def get_promql_response(
+    @staticmethod
+    def check_component_queries(component_queries: List[dict]) -> None:
+        if not isinstance(component_queries, list) or not all(
+            isinstance(component, dict)
+            and isinstance(component.get("type"), str)
+            and isinstance(component.get("cost"), str)
+            for component in component_queries
+        ):
+            raise ERROR_INVALID_PARAMETER(
+                key="options.component_queries",
+                reason="Set a list of {type, cost, usage, usage_unit} queries, "
+                "type and cost are required.",
+            )
+
+    @staticmethod
+    def _make_component_range_queries(
+        component_queries: List[dict], time_windows: List[Tuple[str, str]]
+    ) -> List[Tuple[Tuple[int, str], str, str, str]]:
+        return [
+            ((index, kind), component[kind], window_start, window_end)
+            for index, component in enumerate(component_queries)
+            for kind in _COMPONENT_QUERY_KINDS
+            if component.get(kind)
+            for window_start, window_end in time_windows
+        ]
+
+    @classmethod
+    def _join_component_series(
+        cls,
+        component_queries: List[dict],
+        responses: Dict[Tuple[int, str], List[Series]],
+    ) -> List[Series]:
+        """Attach the usage sample with the same labels and timestamp to every
+        cost sample. The component type is set as the type label unless the
+        cost query returns one itself.
+        """
+        results = []
+        for index, component in enumerate(component_queries):
+            usages = {}
+            for series in responses.get((index, "usage"), []):
+                usages.setdefault(cls._get_join_key(series.metric), {}).update(
+                    zip(series.timestamps, series.costs)
+                )
+
+            for series in responses.get((index, "cost"), []):
+                metric = {
+                    label: value
+                    for label, value in series.metric.items()
+                    if label != "__name__"
+                }
+                metric.setdefault("type", component["type"])
+
+                usage_quantities = None
+                if component.get("usage"):
+                    usage = usages.get(cls._get_join_key(series.metric), {})
+                    usage_quantities = array(
+                        "d",
+                        [usage.get(timestamp, 0.0) for timestamp in series.timestamps],
+                    )
+
+                results.append(
+                    Series(
+                        metric,
+                        series.timestamps,
+                        series.costs,
+                        usage_unit=component.get("usage_unit"),
+                        usage_quantities=usage_quantities,
+                    )
+                )
+
+        return results
+
+    @staticmethod
+    def _get_join_key(metric: dict) -> tuple:
+        return tuple(
+            sorted(
+                (label, value)
+                for label, value in metric.items()
+                if label not in _COMPONENT_JOIN_IGNORED_LABELS
+            )
+        )
+
+    @staticmethod
+    def check_query_shard(query_shard: dict, promql: str) -> None:
+        if query_shard.get("label_matchers") and _SHARD_PLACEHOLDER not in promql:
+            raise ERROR_INVALID_PARAMETER(
+                key="options.query_shard.label_matchers",
+                reason=f"secret_data.promql must contain {_SHARD_PLACEHOLDER} to apply label matchers.",
+            )
+
+    @staticmethod
+    def check_aggregation_level(aggregation_level: str) -> None:
+        if aggregation_level not in _AGGREGATION_LABELS:
+            raise ERROR_INVALID_PARAMETER(
+                key="options.aggregation_level",
+                reason=f"Choose one of {', '.join(_AGGREGATION_LABELS)}.",
+            )
+
+    @staticmethod
+    def get_aggregation_labels(aggregation_level: str) -> List[str]:
+        return _AGGREGATION_LABELS[aggregation_level] + _AGGREGATION_BASE_LABELS
+
+    def aggregate_promql(self, promql: str, aggregation_level: str) -> str:
+        """Wrap the query so Mimir sums series up to the aggregation level.
+
+        The tenant label is kept so that federated queries over several tenants
+        still return one series per tenant; single-tenant series do not have
+        it, so it does not change their grouping.
+        """
+        labels = ", ".join(
+            self.get_aggregation_labels(aggregation_level) + [_TENANT_ID_LABEL]
+        )
+
+        return f"sum by ({labels}) ({promql})"
+
+    def _make_query_shards(
+        self, start: str, promql: str, query_shard: dict, end: str = None
+    ) -> List[Tuple[str, str, str]]:
+        time_windows = self._make_time_windows(
+            start, query_shard.get("window_days"), end
+        )
+
+        if label_matchers := query_shard.get("label_matchers"):
+            promqls = [
+                promql.replace(_SHARD_PLACEHOLDER, label_matcher)
+                for label_matcher in label_matchers
+            ]
+        else:
+            promqls = [self._remove_shard_placeholder(promql)]
+
+        return [
+            (shard_promql, window_start, window_end)
+            for window_start, window_end in time_windows
+            for shard_promql in promqls
+        ]
+
+    @staticmethod
+    def _remove_shard_placeholder(promql: str) -> str:
+        # Without query_shard.label_matchers the placeholder matches nothing,
+        # so it is dropped instead of being sent to Mimir literally.
+        return _SHARD_PLACEHOLDER_PATTERN.sub("", promql)
+
+    def _make_time_windows(
+        self, start: str, window_days: Union[int, None] = None, end: str = None
+    ) -> List[Tuple[str, str]]:
+        """Split the query range into windows of window_days, or of
+        options.query_split_interval aligned to the Unix epoch like the Mimir
+        query-frontend does, so each window maps onto the same cache extents on
+        every sync. Window bounds always fall on step boundaries.
+        """
+        start_unix_timestamp, end_unix_timestamp = self._get_unix_timestamp(start, end)
+        month_start, month_end = int(start_unix_timestamp), int(end_unix_timestamp)
+
+        if window_days:
+            window_seconds = int(window_days) * _SECONDS_PER_DAY
+            window_start = month_start
+        elif self.query_split_interval:
+            window_seconds = self.query_split_interval
+            window_start = month_start - month_start % window_seconds
+        else:
+            return [(start_unix_timestamp, end_unix_timestamp)]
+
+        time_windows = []
+        while window_start <= month_end:
+            window_end = min(window_start + window_seconds - self.query_step, month_end)
+            time_windows.append((str(max(window_start, month_start)), str(window_end)))
+            window_start += window_seconds
+
+        return time_windows
+
+    def _decode_query_range_response(
         self,
         prometheus_query_range_endpoint: str,
+        headers: dict,
+        response: requests.Response,
+    ) -> List[Series]:
+        response.raise_for_status()  # Raise Errors if status code >= 400
+
+        self._observe_response(prometheus_query_range_endpoint, headers, response)
+        with metrics.stage_timer(
+            self.metric_route, self._get_tenant(headers), "decode"
+        ):
+            # Convert series one by one while parsing, so the whole response is
+            # never held as nested dicts.
+            return [
+                Series.from_result(result)
+                for result in ijson.items(
+                    response.content, _RESULT_ITEM_PREFIX, use_float=True
+                )
+            ]
+
+    def _get_split_ranges(
+        self,
+        headers: dict,
+        start_unix_timestamp: str,
+        end_unix_timestamp: str,
+        reason: str,
+    ) -> List[Tuple[str, str]]:
+        range_start, range_end = int(start_unix_timestamp), int(end_unix_timestamp)
+        step_count = (range_end - range_start) // self.query_step + 1
+
+        if not self.query_retry.get("split_on_limit", True) or step_count < 2:
+            _LOGGER.error(f"[_split_query_range] query range failed: {reason}")
+            self._add_failed_range(
+                headers, start_unix_timestamp, end_unix_timestamp, reason
+            )
+            return []
+
+        # Halve the range on a step boundary so both halves keep the same samples.
+        middle = range_start + (step_count // 2) * self.query_step
+        _LOGGER.warning(
+            f"[_split_query_range] split query range at {self._format_unix_timestamp(middle)}: {reason}"
+        )
+
+        return [
+            (start_unix_timestamp, str(middle - self.query_step)),
+            (str(middle), end_unix_timestamp),
+        ]
+
+    def _make_query_range_params(
+        self, promql: str, start_unix_timestamp: str, end_unix_timestamp: str
+    ) -> dict:
+        return {
+            "query": self._remove_shard_placeholder(promql),
+            "start": start_unix_timestamp,
+            "end": end_unix_timestamp,
+            "step": str(self.query_step),
+        }
+
+    def _get_max_retries(self) -> int:
+        return int(self.query_retry.get("max_retries", _DEFAULT_MAX_RETRIES))
+
+    def _should_retry(self, response: requests.Response, is_last_attempt: bool) -> bool:
+        return (
+            not is_last_attempt
+            and response.status_code in _RETRY_STATUS_CODES
+            and not self._is_query_limit_error(response)
+        )
+
+    def _get_connection_retry_delay(
+        self,
+        conn_err: Exception,
+        attempt: int,
+        headers: dict,
+    ) -> float:
+        delay = self._get_backoff_delay(attempt)
+        _LOGGER.warning(
+            f"[_get_with_retry] connection error, retry in {delay:.1f}s: {conn_err}"
+        )
+        metrics.count_retry(
+            self.metric_route, self._get_tenant(headers), "mimir", "connection"
+        )
+
+        return delay
+
+    def _get_status_retry_delay(
+        self,
+        url: str,
+        response: requests.Response,
+        attempt: int,
+        max_retries: int,
+        headers: dict,
+    ) -> float:
+        delay = self._get_retry_delay(response, attempt)
+        _LOGGER.warning(
+            f"[_get_with_retry] HTTP {response.status_code} from {url}, retry in {delay:.1f}s ({attempt + 1}/{max_retries})"
+        )
+        metrics.count_retry(
+            self.metric_route,
+            self._get_tenant(headers),
+            "mimir",
+            str(response.status_code),
+        )
+
+        return delay
+
+    def _get_retry_delay(self, response: requests.Response, attempt: int) -> float:
+        backoff_max = float(self.query_retry.get("backoff_max", _DEFAULT_BACKOFF_MAX))
+
+        if retry_after := response.headers.get("Retry-After"):
+            try:
+                return min(float(retry_after), backoff_max)
+            except ValueError:
+                try:
+                    retry_at = parsedate_to_datetime(retry_after)
+                    delay = (retry_at - datetime.now(timezone.utc)).total_seconds()
+                    return min(max(delay, 0.0), backoff_max)
+                except (TypeError, ValueError):
+                    pass
+
+        return self._get_backoff_delay(attempt)
+
+    def _get_backoff_delay(self, attempt: int) -> float:
+        backoff_base = float(
+            self.query_retry.get("backoff_base", _DEFAULT_BACKOFF_BASE)
+        )
+        backoff_max = float(self.query_retry.get("backoff_max", _DEFAULT_BACKOFF_MAX))
+
+        # Full jitter keeps retries from many workers from hitting Mimir in sync.
+        return random.uniform(0, min(backoff_max, backoff_base * (2**attempt)))
+
+    @staticmethod
+    def _is_query_limit_error(response: requests.Response) -> bool:
+        if response.status_code >= 400:
+            return bool(_QUERY_LIMIT_PATTERN.search(response.text))
+
+        return False
+
+    @staticmethod
+    def _get_error_reason(response: requests.Response) -> str:
+        return f"HTTP {response.status_code}: {response.text[:_ERROR_REASON_LENGTH]}"
+
+    def _add_failed_range(
+        self,
+        headers: dict,
+        start_unix_timestamp: str,
+        end_unix_timestamp: str,
+        reason: Union[str, Exception],
+    ) -> None:
+        metrics.count_error(
+            self.metric_route, self._get_tenant(headers), "mimir", "query_range"
+        )
+        self.failed_ranges.append(
+            {
+                "start": self._format_unix_timestamp(start_unix_timestamp),
+                "end": self._format_unix_timestamp(end_unix_timestamp),
+                "reason": str(reason)[:_ERROR_REASON_LENGTH],
+            }
+        )
+
+    @staticmethod
+    def _format_unix_timestamp(unix_timestamp: Union[str, float]) -> str:
+        return datetime.fromtimestamp(float(unix_timestamp), timezone.utc).strftime(
+            "%Y-%m-%d %H:%M:%S"
+        )
+
+    @staticmethod
+    def _get_tenant(headers: dict) -> str:
+        return headers.get("X-Scope-OrgID", "")
+
+    @staticmethod
+    def _get_api_name(url: str) -> str:
+        return url.rstrip("/").rsplit("/", 1)[-1]
+
+    def _observe_response(
+        self, url: str, headers: dict, response: requests.Response
+    ) -> None:
+        metrics.observe_response_bytes(
+            self.metric_route,
+            self._get_tenant(headers),
+            "mimir",
+            self._get_api_name(url),
+            len(response.content),
+        )
+
+    @staticmethod
+    def _log_query_range_http_error(method: str, http_err: requests.HTTPError) -> None:
+        _LOGGER.error(f"[{method}] HTTP error occurred: {http_err}")
+        _LOGGER.error(
+            f"""[{method}] Modify accuracy of the data to adjust precision:
+                    Decrease (e.g., to 1m): Enhances accuracy. It's typically not recommended to set it below the Prometheus scraping interval (1m by default)
+                    Increase Enhances the performance of the query.
+                """
+        )
+
+    def _get_unix_timestamp(self, start: str, end: str = None) -> (str, str):
+        """Return the first and last step boundary of the query range in UTC.
+
+        The range covers start through the end date (or the end of start's
+        month) inclusive. Both bounds fall on multiples of the step, which lets
+        the Mimir query-frontend serve repeated syncs from its results cache.
+        """
+        start = self._parse_date(start)
+        if end:
+            end = self._parse_date(end)
+        else:
+            end = start.replace(day=calendar.monthrange(start.year, start.month)[1])
+
+        start_unix_timestamp = int(start.timestamp())
+        end_unix_timestamp = int(end.timestamp())
+
+        first_step = start_unix_timestamp - start_unix_timestamp % self.query_step
+        day_end = end_unix_timestamp - end_unix_timestamp % _SECONDS_PER_DAY
+        last_step = day_end + _SECONDS_PER_DAY - self.query_step
+
+        return str(first_step), str(last_step)
+
+    @staticmethod
+    def _parse_date(date: str) -> datetime:
+        try:
+            parsed = datetime.strptime(date, "%Y-%m")
+        except ValueError:
+            parsed = datetime.fromisoformat(date)
+
+        if parsed.tzinfo is None:
+            parsed = parsed.replace(tzinfo=timezone.utc)
+
+        return parsed
+
+    def _get_cached_cluster_info(self, cache_key: tuple) -> Union[dict, None]:
+        if self.cluster_info_cache_ttl:
+            return _CLUSTER_INFO_CACHE.get(cache_key)
+
+    def _parse_cluster_info(
+        self,
+        prometheus_query_endpoint: str,
+        headers: dict,
+        cache_key: tuple,
         start: str,
-        service_account_id: str,
-        promql: str,
-    ) -> Union[List[dict], None]:
-        start_unix_timestamp, end_unix_timestamp = self._get_unix_timestamp(start)
+        response: requests.Response,
+    ) -> dict:
+        response.raise_for_status()
 
-        self.mimir_headers = {
+        self._observe_response(prometheus_query_endpoint, headers, response)
+        response_json = response.json()
+        result = response_json.get("data", {}).get("result", [{}])
+
+        if result:
+            result = response_json
+            if self.cluster_info_cache_ttl:
+                _CLUSTER_INFO_CACHE.set(
+                    cache_key, result, ttl=self.cluster_info_cache_ttl
+                )
+        else:
+            result = {}
+            _LOGGER.debug(
+                f"[get_kubecost_cluster_info] Agent has no metric on your start date: {start}"
+            )
+
+        return result
+
+    @staticmethod
+    def _make_series_count_query(promql: str, by_tenant: bool = True) -> str:
+        promql = BaseMimirConnector._remove_shard_placeholder(promql)
+        if by_tenant:
+            return f"count by ({_TENANT_ID_LABEL}) ({promql})"
+
+        return f"count ({promql})"
+
+    @staticmethod
+    def _merge_series_counts(
+        series_counts: Dict[str, int], tenant_ids: List[str], response_json: dict
+    ) -> None:
+        for series in response_json.get("data", {}).get("result", []):
+            tenant_id = series.get("metric", {}).get(_TENANT_ID_LABEL)
+            if tenant_id is None and len(tenant_ids) == 1:
+                tenant_id = tenant_ids[0]
+
+            if tenant_id in tenant_ids:
+                series_counts[tenant_id] = int(float(series["value"][1]))
+
+    @staticmethod
+    def group_series_by_tenant(
+        results: List[Series], service_account_ids: List[str]
+    ) -> Dict[str, List[Series]]:
+        """Split the series of a federated query by their __tenant_id__ label,
+        in the order of service_account_ids. Series of other tenants are
+        dropped.
+        """
+        tenant_results = {tenant_id: [] for tenant_id in service_account_ids}
+        dropped_count = 0
+        for series in results:
+            tenant_id = series.metric.get(_TENANT_ID_LABEL)
+            if tenant_id in tenant_results:
+                tenant_results[tenant_id].append(series)
+            else:
+                dropped_count += 1
+
+        if dropped_count:
+            _LOGGER.warning(
+                f"[group_series_by_tenant] dropped {dropped_count} series without a known {_TENANT_ID_LABEL}"
+            )
+
+        return {
+            tenant_id: tenant_series
+            for tenant_id, tenant_series in tenant_results.items()
+            if tenant_series
+        }
+
+    @staticmethod
+    def _make_tenant_batches(service_account_ids: List[str]) -> List[List[str]]:
+        return [
+            service_account_ids[offset : offset + _CLUSTER_INFO_BATCH_SIZE]
+            for offset in range(0, len(service_account_ids), _CLUSTER_INFO_BATCH_SIZE)
+        ]
+
+    @staticmethod
+    def _make_headers(service_account_id: str) -> dict:
+        # Built per call: requests of different tenants can run concurrently
+        # on one connector, so headers are never kept on the instance.
+        return {
             "Content-Type": "application/json",
             "X-Scope-OrgID": service_account_id,
         }
 
-        try:
-            response = requests.get(
+    @staticmethod
+    def _make_federated_headers(tenant_ids: List[str]) -> dict:
+        return BaseMimirConnector._make_headers("|".join(tenant_ids))
+
+    @staticmethod
+    def _merge_cluster_infos(
+        cluster_infos: Dict[str, dict], tenant_ids: List[str], response_json: dict
+    ) -> None:
+        data = response_json.get("data", {})
+        for series in data.get("result", []):
+            tenant_id = series.get("metric", {}).get(_TENANT_ID_LABEL)
+            if tenant_id is None and len(tenant_ids) == 1:
+                tenant_id = tenant_ids[0]
+
+            if tenant_id in tenant_ids:
+                cluster_info = cluster_infos.setdefault(
+                    tenant_id,
+                    {
+                        "status": response_json.get("status"),
+                        "data": {
+                            "resultType": data.get("resultType"),
+                            "result": [],
+                        },
+                    },
+                )
+                cluster_info["data"]["result"].append(series)
+
+    def _cache_cluster_infos(
+        self,
+        prometheus_query_endpoint: str,
+        cluster_info_query: str,
+        cluster_infos: Dict[str, dict],
+    ) -> None:
+        if not self.cluster_info_cache_ttl:
+            return
+
+        for tenant_id, cluster_info in cluster_infos.items():
+            _CLUSTER_INFO_CACHE.set(
+                (prometheus_query_endpoint, tenant_id, cluster_info_query),
+                cluster_info,
+                ttl=self.cluster_info_cache_ttl,
+            )
+
+    def get_cost_data(
+        self,
+        promql_response: Iterable[Union[Series, dict]],
+        max_rows: int = None,
+        max_bytes: int = None,
+    ) -> Generator[List[Series], None, None]:
+        """Pack series into pages bounded by output rows and estimated bytes.
+
+        Every sample becomes one cost row, so a series whose samples do not fit
+        into the current page is split across pages by its values. Plain result
+        dicts (e.g. from the result cache) are converted to Series on the way.
+        """
+        max_rows = int(max_rows or _DEFAULT_PAGE_MAX_ROWS)
+        max_bytes = int(max_bytes or _DEFAULT_PAGE_MAX_BYTES)
+
+        page, page_rows, page_bytes = [], 0, 0
+        for series in map(Series.from_result, promql_response):
+            sample_count = len(series)
+            row_bytes = self._estimate_row_bytes(series)
+
+            offset = 0
+            while offset < sample_count:
+                capacity = min(
+                    max_rows - page_rows, (max_bytes - page_bytes) // row_bytes
+                )
+                if capacity <= 0 and page:
+                    yield page
+                    page, page_rows, page_bytes = [], 0, 0
+                    continue
+
+                chunk_size = min(max(capacity, 1), sample_count - offset)
+                if chunk_size == sample_count:
+                    page.append(series)
+                else:
+                    page.append(series.slice(offset, offset + chunk_size))
+
+                page_rows += chunk_size
+                page_bytes += chunk_size * row_bytes
+                offset += chunk_size
+
+        if page:
+            yield page
+
+    @staticmethod
+    def _estimate_row_bytes(series: Series) -> int:
+        label_bytes = sum(
+            len(key) + len(str(value)) for key, value in series.metric.items()
+        )
+
+        return _ROW_BASE_BYTES + label_bytes
+
+
+class MimirConnector(BaseMimirConnector):
+    def get_promql_response(
+        self,
+        prometheus_query_range_endpoint: str,
+        start: str,
+        service_account_id: str,
+        promql: str,
+        end: str = None,
+    ) -> Union[List[Series], None]:
+        headers = self._make_headers(service_account_id)
+
+        time_windows = self._make_time_windows(start, end=end)
+        if len(time_windows) == 1:
+            return self._query_range(
                 prometheus_query_range_endpoint,
-                headers=self.mimir_headers,
-                params={
-                    "query": promql,
-                    "start": start_unix_timestamp,
-                    "end": end_unix_timestamp,
-                    "step": "1d",
-                },
+                headers,
+                promql,
+                *time_windows[0],
             )
 
-            response.raise_for_status()  # Raise Errors if status code >= 400
+        results = []
+        for window_start, window_end in time_windows:
+            results.extend(
+                self._query_range(
+                    prometheus_query_range_endpoint,
+                    headers,
+                    promql,
+                    window_start,
+                    window_end,
+                )
+                or []
+            )
 
-            result = response.json().get("data", {}).get("result")
-            return result
-        except requests.HTTPError as http_err:
-            _LOGGER.error(f"[get_promql_response] HTTP error occurred: {http_err}")
+        return results
+
+    def get_sharded_promql_response(
+        self,
+        prometheus_query_range_endpoint: str,
+        start: str,
+        service_account_id: str,
+        promql: str,
+        query_shard: dict,
+        end: str = None,
+    ) -> Generator[Series, None, None]:
+        shards = iter(self._make_query_shards(start, promql, query_shard, end))
+        max_workers = int(query_shard.get("max_workers", _DEFAULT_SHARD_WORKERS))
+
+        headers = self._make_headers(service_account_id)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+
+            def _submit(shard: Tuple[str, str, str]):
+                shard_promql, shard_start, shard_end = shard
+                return executor.submit(
+                    self._query_range,
+                    prometheus_query_range_endpoint,
+                    headers,
+                    shard_promql,
+                    shard_start,
+                    shard_end,
+                )
+
+            # Keep at most max_workers shards in flight and yield them in order,
+            # so only a bounded number of shard results is held at once.
+            futures = deque(_submit(shard) for shard in islice(shards, max_workers))
+            while futures:
+                result = futures.popleft().result()
+                futures.extend(_submit(shard) for shard in islice(shards, 1))
+
+                yield from result or []
+
+    def get_component_promql_response(
+        self,
+        prometheus_query_range_endpoint: str,
+        start: str,
+        service_account_id: str,
+        component_queries: List[dict],
+        end: str = None,
+    ) -> List[Series]:
+        """Run the cost and usage query of every component concurrently and
+        join them into series carrying a usage quantity per sample.
+        """
+        headers = self._make_headers(service_account_id)
+        queries = self._make_component_range_queries(
+            component_queries, self._make_time_windows(start, end=end)
+        )
+
+        with ThreadPoolExecutor(
+            max_workers=max(min(self.component_workers, len(queries)), 1)
+        ) as executor:
+            futures = [
+                (
+                    query_key,
+                    executor.submit(
+                        self._query_range,
+                        prometheus_query_range_endpoint,
+                        headers,
+                        promql,
+                        window_start,
+                        window_end,
+                    ),
+                )
+                for query_key, promql, window_start, window_end in queries
+            ]
+
+            responses = {}
+            for query_key, future in futures:
+                responses.setdefault(query_key, []).extend(future.result() or [])
+
+        return self._join_component_series(component_queries, responses)
+
+    def _query_range(
+        self,
+        prometheus_query_range_endpoint: str,
+        headers: dict,
+        promql: str,
+        start_unix_timestamp: str,
+        end_unix_timestamp: str,
+    ) -> Union[List[Series], None]:
+        params = self._make_query_range_params(
+            promql, start_unix_timestamp, end_unix_timestamp
+        )
+
+        try:
+            response = self._get_with_retry(
+                prometheus_query_range_endpoint, headers=headers, params=params
+            )
+
+            if self._is_query_limit_error(response):
+                return self._split_query_range(
+                    prometheus_query_range_endpoint,
+                    headers,
+                    promql,
+                    start_unix_timestamp,
+                    end_unix_timestamp,
+                    reason=self._get_error_reason(response),
+                )
+
+            return self._decode_query_range_response(
+                prometheus_query_range_endpoint, headers, response
+            )
+        except requests.ConnectionError as conn_err:
+            # Includes ConnectTimeout: Mimir could not be reached after the
+            # retries, and a smaller range would not reach it either.
             _LOGGER.error(
-                """[get_promql_response] Modify accuracy of the data to adjust precision:
-                    Decrease (e.g., to 1m): Enhances accuracy. It's typically not recommended to set it below the Prometheus scraping interval (1m by default)
-                    Increase Enhances the performance of the query.
-                """
+                f"[get_promql_response] connection error occurred: {conn_err}"
+            )
+            self._add_failed_range(
+                headers, start_unix_timestamp, end_unix_timestamp, conn_err
+            )
+        except requests.ReadTimeout as timeout_err:
+            return self._split_query_range(
+                prometheus_query_range_endpoint,
+                headers,
+                promql,
+                start_unix_timestamp,
+                end_unix_timestamp,
+                reason=str(timeout_err),
+            )
+        except requests.HTTPError as http_err:
+            self._log_query_range_http_error("get_promql_response", http_err)
+            self._add_failed_range(
+                headers, start_unix_timestamp, end_unix_timestamp, http_err
             )
         except Exception as err:
             _LOGGER.error(f"[get_promql_response] error occurred: {err}")
+            self._add_failed_range(
+                headers, start_unix_timestamp, end_unix_timestamp, err
+            )
 
-    @staticmethod
-    def _get_unix_timestamp(start: str) -> (str, str):
-        start = pd.Timestamp(start)
-        end = (pd.Timestamp(start) + MonthEnd(0)).replace(hour=23, minute=59, second=59)
+    def _split_query_range(
+        self,
+        prometheus_query_range_endpoint: str,
+        headers: dict,
+        promql: str,
+        start_unix_timestamp: str,
+        end_unix_timestamp: str,
+        reason: str,
+    ) -> List[Series]:
+        results = []
+        for sub_start, sub_end in self._get_split_ranges(
+            headers, start_unix_timestamp, end_unix_timestamp, reason
+        ):
+            results.extend(
+                self._query_range(
+                    prometheus_query_range_endpoint, headers, promql, sub_start, sub_end
+                )
+                or []
+            )
+
+        return results
+
+    def stream_promql_response(
+        self,
+        prometheus_query_range_endpoint: str,
+        start: str,
+        service_account_id: str,
+        promql: str,
+        end: str = None,
+    ) -> Generator[Series, None, None]:
+        headers = self._make_headers(service_account_id)
+
+        for window_start, window_end in self._make_time_windows(start, end=end):
+            yield from self._stream_query_range(
+                prometheus_query_range_endpoint,
+                headers,
+                promql,
+                window_start,
+                window_end,
+            )
 
-        return str(start.timestamp()), str(end.timestamp())
+    def _stream_query_range(
+        self,
+        prometheus_query_range_endpoint: str,
+        headers: dict,
+        promql: str,
+        start_unix_timestamp: str,
+        end_unix_timestamp: str,
+    ) -> Generator[Series, None, None]:
+        params = self._make_query_range_params(
+            promql, start_unix_timestamp, end_unix_timestamp
+        )
+
+        try:
+            response = self._get_with_retry(
+                prometheus_query_range_endpoint,
+                headers=headers,
+                params=params,
+                stream=True,
+            )
+            limit_reason = (
+                self._get_error_reason(response)
+                if self._is_query_limit_error(response)
+                else None
+            )
+        except requests.ConnectionError as conn_err:
+            _LOGGER.error(
+                f"[stream_promql_response] connection error occurred: {conn_err}"
+            )
+            self._add_failed_range(
+                headers, start_unix_timestamp, end_unix_timestamp, conn_err
+            )
+            return
+        except requests.ReadTimeout as timeout_err:
+            response, limit_reason = None, str(timeout_err)
+        except Exception as err:
+            _LOGGER.error(f"[stream_promql_response] error occurred: {err}")
+            self._add_failed_range(
+                headers, start_unix_timestamp, end_unix_timestamp, err
+            )
+            return
+
+        # Nothing has been yielded yet, so a limited range can still be split.
+        if limit_reason:
+            if response is not None:
+                response.close()
+
+            yield from self._split_query_range(
+                prometheus_query_range_endpoint,
+                headers,
+                promql,
+                start_unix_timestamp,
+                end_unix_timestamp,
+                reason=limit_reason,
+            )
+            return
+
+        try:
+            with response:
+                response.raise_for_status()
+
+                # Feed the body to an incremental parser and hand each series
+                # over as soon as it is complete instead of decoding it at once.
+                series = ijson.sendable_list()
+                parser = ijson.items_coro(series, _RESULT_ITEM_PREFIX, use_float=True)
+                decode_seconds, payload_bytes = 0.0, 0
+                for chunk in response.iter_content(chunk_size=_STREAM_CHUNK_SIZE):
+                    started_at = time.perf_counter()
+                    parser.send(chunk)
+                    decode_seconds += time.perf_counter() - started_at
+                    payload_bytes += len(chunk)
+
+                    yield from map(Series.from_result, series)
+                    del series[:]
+
+                parser.close()
+                yield from map(Series.from_result, series)
+
+            tenant = self._get_tenant(headers)
+            metrics.observe_stage(self.metric_route, tenant, "decode", decode_seconds)
+            metrics.observe_response_bytes(
+                self.metric_route, tenant, "mimir", "query_range", payload_bytes
+            )
+        except requests.HTTPError as http_err:
+            self._log_query_range_http_error("stream_promql_response", http_err)
+            self._add_failed_range(
+                headers, start_unix_timestamp, end_unix_timestamp, http_err
+            )
+        except Exception as err:
+            _LOGGER.error(f"[stream_promql_response] error occurred: {err}")
+            self._add_failed_range(
+                headers, start_unix_timestamp, end_unix_timestamp, err
+            )
+
+    def _get_with_retry(self, url: str, headers: dict, **kwargs) -> requests.Response:
+        max_retries = self._get_max_retries()
+
+        for attempt in range(max_retries + 1):
+            is_last_attempt = attempt == max_retries
+
+            try:
+                response = self._get(url, headers, **kwargs)
+            except requests.ConnectionError as conn_err:
+                if is_last_attempt:
+                    raise
+
+                time.sleep(self._get_connection_retry_delay(conn_err, attempt, headers))
+                continue
+
+            if not self._should_retry(response, is_last_attempt):
+                return response
+
+            response.close()
+            time.sleep(
+                self._get_status_retry_delay(
+                    url, response, attempt, max_retries, headers
+                )
+            )
+
+    def _get(self, url: str, headers: dict, **kwargs) -> requests.Response:
+        session = self.session or get_session(url)
+
+        started_at = time.perf_counter()
+        status = "error"
+        try:
+            response = session.get(url, headers=headers, timeout=self.timeout, **kwargs)
+            status = response.status_code
+            return response
+        finally:
+            metrics.observe_request(
+                self.metric_route,
+                self._get_tenant(headers),
+                "mimir",
+                self._get_api_name(url),
+                time.perf_counter() - started_at,
+                status,
+            )
 
     def get_kubecost_cluster_info(
         self,
@@ -104,43 +1134,150 @@ class MimirConnector(BaseConnector):
         service_account_id: str,
         secret_data: dict,
     ) -> dict:
-        self.mimir_headers = {
-            "Content-Type": "application/json",
-            "X-Scope-OrgID": service_account_id,
-        }
+        cluster_info_query = secret_data["cluster_info_query"]
+        cache_key = (prometheus_query_endpoint, service_account_id, cluster_info_query)
+        if cluster_info := self._get_cached_cluster_info(cache_key):
+            return cluster_info
+
+        headers = self._make_headers(service_account_id)
         try:
-            response = requests.get(
+            response = self._get_with_retry(
                 prometheus_query_endpoint,
-                headers=self.mimir_headers,
+                headers=headers,
                 params={
-                    "query": secret_data["cluster_info_query"],
+                    "query": cluster_info_query,
                 },
             )
 
-            response.raise_for_status()
-
-            result = response.json().get("data", {}).get("result", [{}])
-
-            if result:
-                result = response.json()
-            else:
-                result = {}
-                _LOGGER.debug(
-                    f"[get_kubecost_cluster_info] Agent has no metric on your start date: {start}"
-                )
-
-            return result
+            return self._parse_cluster_info(
+                prometheus_query_endpoint, headers, cache_key, start, response
+            )
         except requests.HTTPError as http_err:
             _LOGGER.error(
                 f"[get_kubecost_cluster_info] HTTP error occurred: {http_err}"
             )
+            metrics.count_error(self.metric_route, service_account_id, "mimir", "query")
         except Exception as err:
             _LOGGER.error(f"[get_kubecost_cluster_info] error occurred: {err}")
+            metrics.count_error(self.metric_route, service_account_id, "mimir", "query")
 
-    @staticmethod
-    def get_cost_data(promql_response: List[dict]) -> Generator[List[dict], None, None]:
-        page_count = int(len(promql_response) / _PAGE_SIZE) + 1
+    def list_kubecost_cluster_infos(
+        self,
+        prometheus_query_endpoint: str,
+        service_account_ids: List[str],
+        secret_data: dict,
+    ) -> Dict[str, dict]:
+        """Query cluster info for many tenants through Mimir tenant federation.
+
+        Series of a federated query carry the tenant in the __tenant_id__ label,
+        which is used to split the response back into per-tenant results.
+        """
+        cluster_info_query = secret_data["cluster_info_query"]
+
+        cluster_infos = {}
+        for tenant_ids in self._make_tenant_batches(service_account_ids):
+            headers = self._make_federated_headers(tenant_ids)
+
+            try:
+                response = self._get_with_retry(
+                    prometheus_query_endpoint,
+                    headers=headers,
+                    params={"query": cluster_info_query},
+                )
+                response.raise_for_status()
+                self._observe_response(prometheus_query_endpoint, headers, response)
+                response_json = response.json()
+            except Exception as err:
+                _LOGGER.error(f"[list_kubecost_cluster_infos] error occurred: {err}")
+                metrics.count_error(
+                    self.metric_route, headers["X-Scope-OrgID"], "mimir", "query"
+                )
+                continue
+
+            self._merge_cluster_infos(cluster_infos, tenant_ids, response_json)
+
+        self._cache_cluster_infos(
+            prometheus_query_endpoint, cluster_info_query, cluster_infos
+        )
+
+        return cluster_infos
+
+    def list_series_counts(
+        self,
+        prometheus_query_endpoint: str,
+        service_account_ids: List[str],
+        promql: str,
+    ) -> Dict[str, int]:
+        """Count the series the cost query currently returns per tenant.
+
+        This is a single instant query per batch of federated tenants, cheap
+        enough to size tasks before any query_range runs. Mimir rejects
+        multi-tenant requests unless tenant federation is enabled, so the
+        tenants of a batch that Mimir answered with an error are counted one
+        by one, at most _SERIES_COUNT_WORKERS at a time. Tenants that failed
+        or have no series are left out.
+        """
+        count_query = self._make_series_count_query(promql)
+
+        series_counts, rejected_tenant_ids = {}, []
+        for tenant_ids in self._make_tenant_batches(service_account_ids):
+            try:
+                response_json = self._query_series_counts(
+                    prometheus_query_endpoint, tenant_ids, count_query
+                )
+            except requests.HTTPError:
+                if len(tenant_ids) > 1:
+                    rejected_tenant_ids.extend(tenant_ids)
+                continue
+            except Exception:
+                continue
+
+            self._merge_series_counts(series_counts, tenant_ids, response_json)
+
+        if not rejected_tenant_ids:
+            return series_counts
+
+        tenant_count_query = self._make_series_count_query(promql, by_tenant=False)
+        with ThreadPoolExecutor(max_workers=_SERIES_COUNT_WORKERS) as executor:
+            futures = [
+                (
+                    tenant_id,
+                    executor.submit(
+                        self._query_series_counts,
+                        prometheus_query_endpoint,
+                        [tenant_id],
+                        tenant_count_query,
+                    ),
+                )
+                for tenant_id in rejected_tenant_ids
+            ]
 
-        for page_num in range(page_count):
-            offset = _PAGE_SIZE * page_num
-            yield promql_response[offset : offset + _PAGE_SIZE]
+            for tenant_id, future in futures:
+                try:
+                    response_json = future.result()
+                except Exception:
+                    continue
+
+                self._merge_series_counts(series_counts, [tenant_id], response_json)
+
+        return series_counts
+
+    def _query_series_counts(
+        self, prometheus_query_endpoint: str, tenant_ids: List[str], count_query: str
+    ) -> dict:
+        headers = self._make_federated_headers(tenant_ids)
+        try:
+            response = self._get_with_retry(
+                prometheus_query_endpoint,
+                headers=headers,
+                params={"query": count_query},
+            )
+            response.raise_for_status()
+            self._observe_response(prometheus_query_endpoint, headers, response)
+            return response.json()
+        except Exception as err:
+            _LOGGER.error(f"[list_series_counts] error occurred: {err}")
+            metrics.count_error(
+                self.metric_route, headers["X-Scope-OrgID"], "mimir", "query"
+            )
+            raise
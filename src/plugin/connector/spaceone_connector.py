@@ -1,11 +1,15 @@
 import logging
 import re
+import time
 
 import requests
 from spaceone.core.connector import BaseConnector
 from spaceone.core.connector.space_connector import SpaceConnector
 from spaceone.core.error import ERROR_REQUIRED_PARAMETER
 
+from ..lib import metrics
+from ..lib.http_session import get_session, get_timeout
+
 __all__ = ["SpaceONEConnector"]
 
 _LOGGER = logging.getLogger(__name__)
@@ -18,6 +22,10 @@ class SpaceONEConnector(BaseConnector):
         self.token = None
         self.protocol = None
         self.endpoint = None
+        self.session = None
+        self.timeout = get_timeout()
+        self.metric_route = ""
+        self.metric_tenant = ""
 
     def init_client(self, options: dict, secret_data: dict, schema: str = None) -> None:
         self._check_secret_data(secret_data)
@@ -29,6 +37,8 @@ class SpaceONEConnector(BaseConnector):
         ):
             self.protocol = "http"
             self.endpoint = spaceone_endpoint
+            self.session = get_session(spaceone_endpoint, options)
+            self.timeout = get_timeout(options)
         elif spaceone_endpoint.startswith("grpc") or spaceone_endpoint.startswith(
             "grpc+ssl"
         ):
@@ -70,31 +80,76 @@ class SpaceONEConnector(BaseConnector):
 
         return self.dispatch("Agent.list", params)
 
+    def list_service_accounts_by_ids(self, service_account_ids: list):
+        params = {
+            "query": {
+                "filter": [
+                    {
+                        "k": "service_account_id",
+                        "v": service_account_ids,
+                        "o": "in",
+                    }
+                ]
+            }
+        }
+
+        return self.dispatch("ServiceAccount.list", params)
+
     def get_service_account(self, service_account_id):
         params = {"service_account_id": service_account_id}
 
         return self.dispatch("ServiceAccount.get", params)
 
     def dispatch(self, method: str = None, params: dict = None, **kwargs):
-        if self.protocol == "grpc":
-            return self.grpc_client.dispatch(method, params, **kwargs)
-        else:
-            return self.request(method, params, **kwargs)
+        started_at = time.perf_counter()
+        status = "error"
+        try:
+            if self.protocol == "grpc":
+                response = self.grpc_client.dispatch(method, params, **kwargs)
+            else:
+                response = self.request(method, params, **kwargs)
+
+            status = "ok"
+            return response
+        except Exception:
+            metrics.count_error(
+                self.metric_route, self.metric_tenant, "spaceone", method
+            )
+            raise
+        finally:
+            metrics.observe_request(
+                self.metric_route,
+                self.metric_tenant,
+                "spaceone",
+                method,
+                time.perf_counter() - started_at,
+                status,
+            )
 
     def request(self, method, params, **kwargs):
-        method = self._convert_method_to_snake_case(method)
-        url = f"{self.endpoint}/{method}"
+        url = f"{self.endpoint}/{self._convert_method_to_snake_case(method)}"
 
         headers = self._make_request_header(self.token, **kwargs)
-        response = requests.post(url, json=params, headers=headers)
+        session = self.session or get_session(self.endpoint)
+        response = session.post(url, json=params, headers=headers, timeout=self.timeout)
 
+        return self._parse_response(method, response)
+
+    def _parse_response(self, method: str, response: requests.Response) -> dict:
         if response.status_code >= 400:
             raise requests.HTTPError(
                 f'HTTP {response.status_code} Error: {response.json()["detail"]}'
             )
 
-        response = response.json()
-        return response
+        metrics.observe_response_bytes(
+            self.metric_route,
+            self.metric_tenant,
+            "spaceone",
+            method,
+            len(response.content),
+        )
+
+        return response.json()
 
     @staticmethod
     def _convert_method_to_snake_case(method):
@@ -0,0 +1,3 @@
+from plugin.error.mimir import ERROR_MIMIR_QUERY_RANGE_FAILED
+
+__all__ = ["ERROR_MIMIR_QUERY_RANGE_FAILED"]
@@ -0,0 +1,5 @@
+from spaceone.core.error import ERROR_UNKNOWN
+
+
+class ERROR_MIMIR_QUERY_RANGE_FAILED(ERROR_UNKNOWN):
+    _message = "Failed to query Mimir for some time ranges. (service_account_id = {service_account_id}, failed_ranges = {failed_ranges})"
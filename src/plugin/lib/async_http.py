@@ -0,0 +1,135 @@
+import asyncio
+import atexit
+import threading
+from typing import Awaitable, Union
+from urllib.parse import urlsplit
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from .http_session import get_timeout
+
+__all__ = ["run", "get_async_session", "get_semaphore", "request"]
+
+_DEFAULT_POOL_SIZE = 10
+
+_LOOP = None
+_LOOP_LOCK = threading.Lock()
+
+# Only touched from the event loop thread.
+_SESSIONS = {}
+_SEMAPHORES = {}
+
+
+def run(awaitable: Awaitable):
+    """Run a coroutine on the process-wide event loop and wait for its result.
+
+    Plugin routes are served from synchronous worker threads, so every caller
+    shares one loop running in a daemon thread. Keeping the loop alive lets the
+    aiohttp connection pools outlive a single request.
+    """
+    return asyncio.run_coroutine_threadsafe(awaitable, _get_loop()).result()
+
+
+def get_async_session(endpoint: str, options: Union[dict, None] = None):
+    """Return the pooled aiohttp session for the endpoint's host.
+
+    Must be called from a coroutine running on the loop used by run().
+    """
+    import aiohttp
+
+    pool_size = int((options or {}).get("http_pool_size", _DEFAULT_POOL_SIZE))
+    url = urlsplit(endpoint)
+    key = (url.scheme, url.netloc, pool_size)
+
+    session = _SESSIONS.get(key)
+    if session is None or session.closed:
+        session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=pool_size),
+            headers={"Accept-Encoding": "gzip, deflate"},
+        )
+        _SESSIONS[key] = session
+
+    return session
+
+
+def get_semaphore(endpoint: str, limit: int) -> asyncio.Semaphore:
+    """Return the semaphore bounding concurrent requests to the endpoint's host."""
+    url = urlsplit(endpoint)
+    key = (url.scheme, url.netloc, limit)
+
+    semaphore = _SEMAPHORES.get(key)
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(max(limit, 1))
+        _SEMAPHORES[key] = semaphore
+
+    return semaphore
+
+
+async def request(
+    session,
+    method: str,
+    url: str,
+    timeout: tuple = None,
+    **kwargs,
+) -> requests.Response:
+    """Send a request and return the fully read body as a requests.Response.
+
+    aiohttp errors are mapped to their requests counterparts, so callers can
+    share status handling, retries and decoding with the synchronous path.
+    """
+    import aiohttp
+
+    connect_timeout, read_timeout = timeout or get_timeout()
+    client_timeout = aiohttp.ClientTimeout(
+        sock_connect=connect_timeout, sock_read=read_timeout
+    )
+
+    try:
+        async with session.request(
+            method, url, timeout=client_timeout, **kwargs
+        ) as client_response:
+            body = await client_response.read()
+    except aiohttp.ConnectionTimeoutError as timeout_err:
+        raise requests.ConnectTimeout(f"{method} {url} timed out") from timeout_err
+    except asyncio.TimeoutError as timeout_err:
+        raise requests.ReadTimeout(f"{method} {url} timed out") from timeout_err
+    except aiohttp.ClientConnectionError as conn_err:
+        raise requests.ConnectionError(str(conn_err)) from conn_err
+
+    response = requests.Response()
+    response.status_code = client_response.status
+    response.reason = client_response.reason
+    response.headers = CaseInsensitiveDict(client_response.headers)
+    response.url = str(client_response.url)
+    response.encoding = client_response.charset
+    response._content = body
+
+    return response
+
+
+def _get_loop() -> asyncio.AbstractEventLoop:
+    global _LOOP
+
+    with _LOOP_LOCK:
+        if _LOOP is None:
+            _LOOP = asyncio.new_event_loop()
+            threading.Thread(
+                target=_LOOP.run_forever, name="plugin-async-http", daemon=True
+            ).start()
+            atexit.register(_close_loop)
+
+    return _LOOP
+
+
+def _close_loop() -> None:
+    async def _close_sessions():
+        for session in _SESSIONS.values():
+            await session.close()
+
+        _SESSIONS.clear()
+
+    try:
+        asyncio.run_coroutine_threadsafe(_close_sessions(), _LOOP).result(timeout=5)
+    finally:
+        _LOOP.call_soon_threadsafe(_LOOP.stop)
@@ -0,0 +1,58 @@
+import threading
+from typing import Tuple, Union
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+__all__ = ["get_session", "get_timeout"]
+
+_DEFAULT_POOL_SIZE = 10
+_DEFAULT_CONNECT_TIMEOUT = 10
+_DEFAULT_READ_TIMEOUT = 300
+_DEFAULT_HEADERS = {
+    "Accept-Encoding": "gzip, deflate",
+    "Connection": "keep-alive",
+}
+
+_SESSIONS = {}
+_LOCK = threading.Lock()
+
+
+def get_session(endpoint: str, options: Union[dict, None] = None) -> requests.Session:
+    """Return the process-wide keep-alive session for the endpoint's host.
+
+    Sessions are shared by every connector and plugin route, so repeated calls
+    to the same Mimir or SpaceONE endpoint reuse pooled TCP/TLS connections.
+    """
+    pool_size = int((options or {}).get("http_pool_size", _DEFAULT_POOL_SIZE))
+    url = urlsplit(endpoint)
+    key = (url.scheme, url.netloc, pool_size)
+
+    with _LOCK:
+        session = _SESSIONS.get(key)
+        if session is None:
+            session = _create_session(pool_size)
+            _SESSIONS[key] = session
+
+    return session
+
+
+def get_timeout(options: Union[dict, None] = None) -> Tuple[float, float]:
+    options = options or {}
+
+    return (
+        float(options.get("http_connect_timeout", _DEFAULT_CONNECT_TIMEOUT)),
+        float(options.get("http_read_timeout", _DEFAULT_READ_TIMEOUT)),
+    )
+
+
+def _create_session(pool_size: int) -> requests.Session:
+    session = requests.Session()
+    session.headers.update(_DEFAULT_HEADERS)
+
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+
+    return session
@@ -0,0 +1,152 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Union
+
+__all__ = [
+    "observe_request",
+    "observe_response_bytes",
+    "count_retry",
+    "count_error",
+    "observe_stage",
+    "stage_timer",
+    "observe_task",
+    "count_removed_rows",
+    "start_metrics_server",
+]
+
+_LOGGER = logging.getLogger("spaceone")
+
+_NAMESPACE = "opencost_datasource"
+_BYTES_BUCKETS = [2**exponent for exponent in range(10, 31, 2)]
+_COUNT_BUCKETS = [10**exponent for exponent in range(0, 8)]
+
+_COLLECTORS = {}
+_COLLECTORS_LOCK = threading.Lock()
+
+
+def _get_collector(name: str):
+    # prometheus_client is imported on first use to keep it off the plugin's
+    # import path.
+    if not _COLLECTORS:
+        with _COLLECTORS_LOCK:
+            if not _COLLECTORS:
+                _COLLECTORS.update(_make_collectors())
+
+    return _COLLECTORS[name]
+
+
+def _make_collectors() -> dict:
+    from prometheus_client import Counter, Histogram
+
+    return {
+        "request_latency": Histogram(
+            "request_duration_seconds",
+            "Latency of HTTP/gRPC calls to Mimir and SpaceONE.",
+            ["route", "tenant", "target", "method", "status"],
+            namespace=_NAMESPACE,
+        ),
+        "response_bytes": Histogram(
+            "response_bytes",
+            "Decoded payload size of responses from Mimir and SpaceONE.",
+            ["route", "tenant", "target", "method"],
+            namespace=_NAMESPACE,
+            buckets=_BYTES_BUCKETS,
+        ),
+        "retries": Counter(
+            "retries_total",
+            "Retried calls by reason.",
+            ["route", "tenant", "target", "reason"],
+            namespace=_NAMESPACE,
+        ),
+        "errors": Counter(
+            "errors_total",
+            "Calls that failed permanently.",
+            ["route", "tenant", "target", "method"],
+            namespace=_NAMESPACE,
+        ),
+        "stage_duration": Histogram(
+            "stage_duration_seconds",
+            "Time spent per processing stage (transform is measured per page).",
+            ["route", "tenant", "stage"],
+            namespace=_NAMESPACE,
+        ),
+        "task_series": Histogram(
+            "task_series",
+            "Series processed per task (agents per call for Job.get_tasks).",
+            ["route", "tenant"],
+            namespace=_NAMESPACE,
+            buckets=_COUNT_BUCKETS,
+        ),
+        "task_rows": Histogram(
+            "task_rows",
+            "Rows emitted per task (tasks generated per call for Job.get_tasks).",
+            ["route", "tenant"],
+            namespace=_NAMESPACE,
+            buckets=_COUNT_BUCKETS,
+        ),
+        "removed_rows": Counter(
+            "removed_rows_total",
+            "Rows dropped by the reduce_rows stage, by reason.",
+            ["route", "tenant", "reason"],
+            namespace=_NAMESPACE,
+        ),
+    }
+
+
+def observe_request(
+    route: str,
+    tenant: str,
+    target: str,
+    method: str,
+    seconds: float,
+    status: Union[int, str] = "",
+) -> None:
+    _get_collector("request_latency").labels(
+        route, tenant, target, method, str(status)
+    ).observe(seconds)
+
+
+def observe_response_bytes(
+    route: str, tenant: str, target: str, method: str, size: int
+) -> None:
+    _get_collector("response_bytes").labels(route, tenant, target, method).observe(size)
+
+
+def count_retry(route: str, tenant: str, target: str, reason: str) -> None:
+    _get_collector("retries").labels(route, tenant, target, reason).inc()
+
+
+def count_error(route: str, tenant: str, target: str, method: str) -> None:
+    _get_collector("errors").labels(route, tenant, target, method).inc()
+
+
+def observe_stage(route: str, tenant: str, stage: str, seconds: float) -> None:
+    _get_collector("stage_duration").labels(route, tenant, stage).observe(seconds)
+
+
+@contextmanager
+def stage_timer(route: str, tenant: str, stage: str):
+    started_at = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(route, tenant, stage, time.perf_counter() - started_at)
+
+
+def observe_task(route: str, tenant: str, series: int, rows: int) -> None:
+    _get_collector("task_series").labels(route, tenant).observe(series)
+    _get_collector("task_rows").labels(route, tenant).observe(rows)
+
+
+def count_removed_rows(route: str, tenant: str, reason: str, count: int) -> None:
+    _get_collector("removed_rows").labels(route, tenant, reason).inc(count)
+
+
+def start_metrics_server(port: int, addr: str = "0.0.0.0") -> None:
+    """Expose the collected metrics on http://<addr>:<port>/metrics."""
+    from prometheus_client import start_http_server
+
+    start_http_server(port, addr=addr)
+    _LOGGER.info(f"[start_metrics_server] serving /metrics on {addr}:{port}")
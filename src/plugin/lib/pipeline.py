@@ -0,0 +1,69 @@
+import queue
+import threading
+from typing import Generator, Iterable, TypeVar
+
+__all__ = ["prefetch"]
+
+_T = TypeVar("_T")
+
+_PUT_TIMEOUT = 0.1
+_END = object()
+
+
+class _Failure:
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+def prefetch(
+    iterable: Iterable[_T], max_size: int, name: str = "prefetch"
+) -> Generator[_T, None, None]:
+    """Iterate the iterable in a background thread, up to max_size items ahead.
+
+    The bounded queue is the backpressure: once max_size items are waiting the
+    producer blocks until the consumer takes one. Exceptions raised by the
+    producer are re-raised to the consumer in order. Closing the returned
+    generator stops the producer and closes the source iterator.
+    """
+    items = queue.Queue(maxsize=max(max_size, 1))
+    stopped = threading.Event()
+
+    def _put(item) -> bool:
+        while not stopped.is_set():
+            try:
+                items.put(item, timeout=_PUT_TIMEOUT)
+                return True
+            except queue.Full:
+                continue
+
+        return False
+
+    def _produce():
+        iterator = iter(iterable)
+        try:
+            for item in iterator:
+                if not _put(item):
+                    break
+            else:
+                _put(_END)
+        except BaseException as error:
+            _put(_Failure(error))
+        finally:
+            if close := getattr(iterator, "close", None):
+                close()
+
+    producer = threading.Thread(target=_produce, name=f"plugin-{name}", daemon=True)
+    producer.start()
+
+    try:
+        while True:
+            item = items.get()
+            if item is _END:
+                return
+
+            if isinstance(item, _Failure):
+                raise item.error
+
+            yield item
+    finally:
+        stopped.set()
@@ -0,0 +1,43 @@
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.util import Finalize
+
+__all__ = ["get_process_pool"]
+
+_POOLS = {}
+_POOLS_LOCK = threading.Lock()
+
+
+def get_process_pool(max_workers: int) -> ProcessPoolExecutor:
+    """Return the process-wide pool with max_workers worker processes.
+
+    Workers are spawned rather than forked, since the plugin server runs many
+    threads, and are kept for the lifetime of the process so that their start
+    up cost is paid once.
+    """
+    with _POOLS_LOCK:
+        pool = _POOLS.get(max_workers)
+        if pool is None:
+            if not _POOLS:
+                # Unlike atexit handlers, finalizers also run when the caller
+                # is itself a multiprocessing child, which otherwise waits on
+                # the idle workers forever when it exits. The priority makes it
+                # run before the finalizers of the pool's own queues.
+                Finalize(None, _shutdown_pools, exitpriority=100)
+
+            pool = ProcessPoolExecutor(
+                max_workers=max_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+            _POOLS[max_workers] = pool
+
+    return pool
+
+
+def _shutdown_pools() -> None:
+    with _POOLS_LOCK:
+        for pool in _POOLS.values():
+            pool.shutdown(cancel_futures=True)
+
+        _POOLS.clear()
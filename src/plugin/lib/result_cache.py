@@ -0,0 +1,163 @@
+import gzip
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import zlib
+from typing import Generator, Iterable, Union
+
+from .series import Series
+
+__all__ = ["ResultCache"]
+
+_LOGGER = logging.getLogger("spaceone")
+
+_DEFAULT_CACHE_DIR = os.path.join(tempfile.gettempdir(), "opencost-result-cache")
+_DEFAULT_MAX_SIZE_MB = 1024
+_CACHE_FILE_SUFFIX = ".jsonl.gz"
+_VERIFY_CHUNK_SIZE = 1024 * 1024
+
+
+class ResultCache:
+    """On-disk cache of query_range series for windows that are already closed.
+
+    Each entry is a gzip-compressed JSON lines file with one series per line,
+    so both writing and reading stream without holding the window in memory.
+    The least recently used entries are evicted once the directory exceeds
+    its size budget.
+    """
+
+    def __init__(self, path: str = None, max_size_mb: int = None):
+        self.path = path or _DEFAULT_CACHE_DIR
+        self.max_bytes = int(max_size_mb or _DEFAULT_MAX_SIZE_MB) * 1024 * 1024
+
+        os.makedirs(self.path, exist_ok=True)
+
+    @staticmethod
+    def make_key(
+        tenant_id: str,
+        endpoint: str,
+        promql: str,
+        start: str,
+        end: Union[str, None],
+        step: int,
+        query_options: dict,
+    ) -> str:
+        promql_hash = hashlib.sha256(promql.encode("utf-8")).hexdigest()
+        raw_key = "\n".join(
+            [
+                tenant_id,
+                endpoint,
+                promql_hash,
+                start,
+                end or "",
+                str(step),
+                json.dumps(query_options, sort_keys=True),
+            ]
+        )
+
+        return hashlib.sha256(raw_key.encode("utf-8")).hexdigest()
+
+    def read(self, key: str) -> Union[Generator[Series, None, None], None]:
+        file_path = self._get_file_path(key)
+        if not os.path.exists(file_path):
+            return None
+
+        # A damaged entry is dropped before any of its series are handed out,
+        # so the caller queries the window again instead of ingesting part of it.
+        if not self._is_intact(file_path):
+            self._remove(file_path)
+            return None
+
+        try:
+            os.utime(file_path)
+        except OSError:
+            return None
+
+        return self._read_series(file_path)
+
+    def write_through(
+        self, key: str, series_stream: Iterable[Series], is_complete=None
+    ) -> Generator[Series, None, None]:
+        """Yield the stream unchanged while writing it to a temporary file.
+
+        The entry is published only when the stream is fully consumed and
+        is_complete() agrees, so partial results are never cached.
+        """
+        fd, temp_path = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+        committed = False
+
+        try:
+            with gzip.open(os.fdopen(fd, "wb"), "wt", encoding="utf-8") as f:
+                for series in series_stream:
+                    f.write(json.dumps(series.to_result(), separators=(",", ":")))
+                    f.write("\n")
+                    yield series
+
+            if is_complete is None or is_complete():
+                os.replace(temp_path, self._get_file_path(key))
+                committed = True
+                self._evict()
+        finally:
+            if not committed and os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    @staticmethod
+    def _is_intact(file_path: str) -> bool:
+        """Decompress the entry once to check its gzip CRC and length."""
+        try:
+            with gzip.open(file_path, "rb") as f:
+                while f.read(_VERIFY_CHUNK_SIZE):
+                    pass
+        except (OSError, EOFError, zlib.error) as err:
+            _LOGGER.warning(f"[ResultCache] corrupt entry {file_path}: {err}")
+            return False
+
+        return True
+
+    def _read_series(self, file_path: str) -> Generator[Series, None, None]:
+        try:
+            with gzip.open(file_path, "rt", encoding="utf-8") as f:
+                for line in f:
+                    yield Series.from_result(json.loads(line))
+        except (OSError, EOFError, zlib.error, ValueError, KeyError) as err:
+            _LOGGER.warning(f"[ResultCache] corrupt entry {file_path}: {err}")
+            self._remove(file_path)
+            raise
+
+    @staticmethod
+    def _remove(file_path: str) -> None:
+        try:
+            os.remove(file_path)
+        except OSError:
+            pass
+
+    def _evict(self) -> None:
+        entries = []
+        total_size = 0
+        for file_name in os.listdir(self.path):
+            if not file_name.endswith(_CACHE_FILE_SUFFIX):
+                continue
+
+            try:
+                stat = os.stat(os.path.join(self.path, file_name))
+            except OSError:
+                continue
+
+            entries.append((stat.st_mtime, stat.st_size, file_name))
+            total_size += stat.st_size
+
+        for _, size, file_name in sorted(entries):
+            if total_size <= self.max_bytes:
+                break
+
+            try:
+                os.remove(os.path.join(self.path, file_name))
+                total_size -= size
+                _LOGGER.debug(f"[ResultCache] evict {file_name}")
+            except OSError:
+                continue
+
+    def _get_file_path(self, key: str) -> str:
+        return os.path.join(self.path, f"{key}{_CACHE_FILE_SUFFIX}")
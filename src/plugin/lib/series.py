@@ -0,0 +1,109 @@
+import sys
+from array import array
+from typing import Union
+
+__all__ = ["Series"]
+
+
+class Series:
+    """Compact in-memory form of one query_range series.
+
+    Label strings are interned, so the cluster/node/namespace values repeated
+    across thousands of series are stored once, and samples live in two typed
+    arrays instead of a list of [timestamp, "value"] pairs. usage_quantities
+    optionally holds a usage value per sample, overriding usage_quantity.
+    """
+
+    __slots__ = (
+        "metric",
+        "timestamps",
+        "costs",
+        "usage_quantity",
+        "usage_unit",
+        "tags",
+        "usage_quantities",
+    )
+
+    def __init__(
+        self,
+        metric: dict,
+        timestamps: array,
+        costs: array,
+        usage_quantity: float = 0,
+        usage_unit: Union[str, None] = None,
+        tags: Union[dict, None] = None,
+        usage_quantities: Union[array, None] = None,
+    ):
+        self.metric = metric
+        self.timestamps = timestamps
+        self.costs = costs
+        self.usage_quantity = usage_quantity
+        self.usage_unit = usage_unit
+        self.tags = tags if tags is not None else {}
+        self.usage_quantities = usage_quantities
+
+    def __len__(self) -> int:
+        return len(self.timestamps)
+
+    @classmethod
+    def from_result(cls, result: Union[dict, "Series"]) -> "Series":
+        if isinstance(result, cls):
+            return result
+
+        values = result.get("values", [])
+
+        return cls(
+            metric={
+                sys.intern(key): sys.intern(value) if isinstance(value, str) else value
+                for key, value in result["metric"].items()
+            },
+            timestamps=array("d", [float(value[0]) for value in values]),
+            costs=array("d", [float(value[1]) for value in values]),
+            usage_quantity=result.get("usage_quantity", 0),
+            usage_unit=result.get("usage_unit"),
+            tags=result.get("tags"),
+            usage_quantities=(
+                array("d", result["usage_quantities"])
+                if "usage_quantities" in result
+                else None
+            ),
+        )
+
+    def to_result(self) -> dict:
+        result = {
+            "metric": self.metric,
+            "values": [
+                [timestamp, repr(cost)]
+                for timestamp, cost in zip(self.timestamps, self.costs)
+            ],
+        }
+
+        if self.usage_quantity:
+            result["usage_quantity"] = self.usage_quantity
+
+        if self.usage_unit is not None:
+            result["usage_unit"] = self.usage_unit
+
+        if self.tags:
+            result["tags"] = self.tags
+
+        if self.usage_quantities is not None:
+            result["usage_quantities"] = self.usage_quantities.tolist()
+
+        return result
+
+    def slice(self, start: int, stop: int) -> "Series":
+        """Return the samples in [start, stop) sharing this series' labels."""
+        return Series(
+            self.metric,
+            self.timestamps[start:stop],
+            self.costs[start:stop],
+            self.usage_quantity,
+            self.usage_unit,
+            self.tags,
+            (
+                self.usage_quantities[start:stop]
+                if self.usage_quantities is not None
+                else None
+            ),
+        )
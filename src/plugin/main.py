@@ -1,13 +1,18 @@
+import os
 from typing import Generator
 
 from spaceone.cost_analysis.plugin.data_source.lib.server import DataSourcePluginServer
 
+from .lib.metrics import start_metrics_server
 from .manager.cost_manager import CostManager
 from .manager.data_source_manager import DataSourceManager
 from .manager.job_manager import JobManager
 
 app = DataSourcePluginServer()
 
+if metrics_port := os.environ.get("PLUGIN_METRICS_PORT"):
+    start_metrics_server(int(metrics_port))
+
 
 @app.route("DataSource.init")
 def data_source_init(params: dict) -> dict:
@@ -1,15 +1,48 @@
+import asyncio
+import json
 import logging
-from typing import Generator, List, Union
+import math
+import time
+from array import array
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from itertools import chain, repeat
+from typing import Generator, Iterable, Iterator, List, Tuple, Union
 
-import pandas as pd
 from spaceone.core.manager import BaseManager
 from spaceone.cost_analysis.error import ERROR_REQUIRED_PARAMETER
 
+from ..connector.async_mimir_connector import AsyncMimirConnector
+from ..connector.async_spaceone_connector import AsyncSpaceONEConnector
 from ..connector.mimir_connector import MimirConnector
 from ..connector.spaceone_connector import SpaceONEConnector
+from ..error import ERROR_MIMIR_QUERY_RANGE_FAILED
+from ..lib import async_http, metrics, pipeline
+from ..lib.process_pool import get_process_pool
+from ..lib.result_cache import ResultCache
+from ..lib.series import Series
 
 _LOGGER = logging.getLogger("spaceone")
 
+_METRIC_ROUTE = "Cost.get_data"
+
+_ADDITIONAL_INFO_LABELS = {
+    "cluster": "Cluster",
+    "node": "Node",
+    "namespace": "Namespace",
+    "pod": "Pod",
+    "container": "Container",
+    "persistentvolume": "PV",
+    "service_name": "Load Balancer",
+}
+
+_SECONDS_PER_DAY = 86400
+_DEFAULT_TRANSFORM_OFFLOAD_MIN_ROWS = 5000
+# JobManager re-syncs from seven days before the last sync, so a window still
+# changes for a while after it ends. One more day covers a daily schedule.
+_DEFAULT_RESULT_CACHE_FINAL_AFTER_DAYS = 8
+
 _REQUIRED_FIELDS = [
     "cost",
 ]
@@ -54,6 +87,22 @@ class CostManager(BaseManager):
         super().__init__(*args, **kwargs)
         self.mimir_connector: MimirConnector = MimirConnector()
         self.spaceone_connector: SpaceONEConnector = SpaceONEConnector()
+        self.async_mimir_connector: AsyncMimirConnector = AsyncMimirConnector()
+        self.async_spaceone_connector: AsyncSpaceONEConnector = AsyncSpaceONEConnector()
+        for connector in [
+            self.mimir_connector,
+            self.spaceone_connector,
+            self.async_mimir_connector,
+            self.async_spaceone_connector,
+        ]:
+            connector.metric_route = _METRIC_ROUTE
+
+        self.additional_info_labels = list(_ADDITIONAL_INFO_LABELS)
+        self.reduce_rows = False
+        self.transform_workers = 0
+        self.transform_offload_min_rows = _DEFAULT_TRANSFORM_OFFLOAD_MIN_ROWS
+        self.pipeline_prefetch_pages = 0
+        self.service_account_ids = []
 
     def get_data(
         self,
@@ -64,32 +113,138 @@ class CostManager(BaseManager):
         task_options: Union[dict, None],
     ) -> Generator[dict, None, None]:
         self.spaceone_connector.init_client(options, secret_data, schema)
+        self.mimir_connector.init_client(options, secret_data, schema)
 
         start = task_options.get("start")
+        end = task_options.get("end")
         service_account_id = task_options.get("service_account_id")
 
-        self._check_resource_group(domain_id, options)
+        # Federated tasks of JobManager query several small tenants at once and
+        # split the series back by tenant.
+        self.service_account_ids = task_options.get("service_account_ids") or []
+        if self.service_account_ids:
+            service_account_id = "|".join(self.service_account_ids)
+            task_options = dict(task_options, service_account_id=service_account_id)
+
+        self.spaceone_connector.metric_tenant = domain_id
+        self.reduce_rows = options.get("reduce_rows", False)
+        self.transform_workers = int(options.get("transform_workers", 0))
+        self.transform_offload_min_rows = int(
+            options.get(
+                "transform_offload_min_rows", _DEFAULT_TRANSFORM_OFFLOAD_MIN_ROWS
+            )
+        )
+        self.pipeline_prefetch_pages = int(options.get("pipeline_prefetch_pages", 0))
 
-        try:
-            prometheus_query_range_endpoint = (
-                f"{secret_data['mimir_endpoint']}/api/v1/query_range"
+        if component_queries := options.get("component_queries"):
+            self.mimir_connector.check_component_queries(component_queries)
+
+        if aggregation_level := options.get("aggregation_level"):
+            self.mimir_connector.check_aggregation_level(aggregation_level)
+
+            secret_data = dict(
+                secret_data,
+                promql=self.mimir_connector.aggregate_promql(
+                    secret_data.get("promql", ""), aggregation_level
+                ),
             )
+            if component_queries:
+                options = dict(
+                    options,
+                    component_queries=[
+                        dict(
+                            component,
+                            **{
+                                kind: self.mimir_connector.aggregate_promql(
+                                    component[kind], aggregation_level
+                                )
+                                for kind in ["cost", "usage"]
+                                if component.get(kind)
+                            },
+                        )
+                        for component in component_queries
+                    ],
+                )
+            self.additional_info_labels = [
+                label
+                for label in self.mimir_connector.get_aggregation_labels(
+                    aggregation_level
+                )
+                if label in _ADDITIONAL_INFO_LABELS
+            ]
 
-            promql_response = self.mimir_connector.get_promql_response(
-                prometheus_query_range_endpoint,
-                start,
-                service_account_id,
-                secret_data["promql"],
+        if query_shard := options.get("query_shard"):
+            self.mimir_connector.check_query_shard(
+                query_shard, secret_data.get("promql", "")
             )
 
-            prometheus_query_endpoint = f"{secret_data['mimir_endpoint']}/api/v1/query"
-            cluster_info = self.mimir_connector.get_kubecost_cluster_info(
-                prometheus_query_endpoint, start, service_account_id, secret_data
+        async_io = options.get("async_io", False)
+        if async_io:
+            self.async_spaceone_connector.init_client(options, secret_data, schema)
+            self.async_mimir_connector.init_client(options, secret_data, schema)
+            self.async_spaceone_connector.metric_tenant = domain_id
+
+            # The agent check, the query_range call and the cluster info query
+            # do not depend on each other, so they are issued concurrently.
+            agents_response, promql_response, cluster_info = async_http.run(
+                self._get_responses_concurrently(
+                    domain_id, options, secret_data, task_options
+                )
             )
+            if isinstance(agents_response, Exception):
+                raise agents_response
+        else:
+            self._check_resource_group(domain_id, options)
+
+        try:
+            if async_io:
+                for response in [promql_response, cluster_info]:
+                    if isinstance(response, Exception):
+                        raise response
+            else:
+                prometheus_query_range_endpoint = (
+                    f"{secret_data['mimir_endpoint']}/api/v1/query_range"
+                )
+                cluster_info_args = (
+                    start,
+                    service_account_id,
+                    secret_data,
+                    task_options,
+                )
+
+                with ThreadPoolExecutor(max_workers=1) as executor:
+                    # In pipeline mode the cluster info query runs while the
+                    # query_range response is being fetched.
+                    cluster_info_future = (
+                        executor.submit(self._get_cluster_info, *cluster_info_args)
+                        if self.pipeline_prefetch_pages
+                        else None
+                    )
+
+                    promql_response = self._get_promql_response(
+                        prometheus_query_range_endpoint,
+                        start,
+                        end,
+                        service_account_id,
+                        options,
+                        secret_data,
+                    )
+
+                    if cluster_info_future:
+                        cluster_info = cluster_info_future.result()
+                    else:
+                        cluster_info = self._get_cluster_info(*cluster_info_args)
 
             if promql_response:
+                if self.reduce_rows:
+                    promql_response = self._reduce_response(
+                        promql_response, service_account_id
+                    )
+
                 promql_response_stream = self.mimir_connector.get_cost_data(
-                    promql_response
+                    promql_response,
+                    max_rows=options.get("page_max_rows"),
+                    max_bytes=options.get("page_max_bytes"),
                 )
 
                 yield from self._process_response_stream(
@@ -105,10 +260,369 @@ class CostManager(BaseManager):
                     "Or the SpaceONE Agent has not been installed yet. Please install the agent on your cluster."
                 )
                 yield {"results": []}
+
+            self._check_failed_ranges(service_account_id)
+        except ERROR_MIMIR_QUERY_RANGE_FAILED:
+            raise
         except Exception as e:
             _LOGGER.error("Error processing data: %s", str(e), exc_info=True)
             yield {"results": []}
 
+    def _get_cluster_info(
+        self,
+        start: str,
+        service_account_id: str,
+        secret_data: dict,
+        task_options: dict,
+    ) -> dict:
+        if cluster_info := task_options.get("cluster_info"):
+            return cluster_info
+
+        if self.service_account_ids:
+            return task_options.get(
+                "cluster_infos"
+            ) or self.mimir_connector.list_kubecost_cluster_infos(
+                f"{secret_data['mimir_endpoint']}/api/v1/query",
+                self.service_account_ids,
+                secret_data,
+            )
+
+        return self.mimir_connector.get_kubecost_cluster_info(
+            f"{secret_data['mimir_endpoint']}/api/v1/query",
+            start,
+            service_account_id,
+            secret_data,
+        )
+
+    async def _get_responses_concurrently(
+        self,
+        domain_id: str,
+        options: dict,
+        secret_data: dict,
+        task_options: dict,
+    ) -> list:
+        start = task_options.get("start")
+        end = task_options.get("end")
+        service_account_id = task_options.get("service_account_id")
+
+        return await asyncio.gather(
+            self._check_resource_group_async(domain_id, options),
+            self._get_promql_response_async(
+                f"{secret_data['mimir_endpoint']}/api/v1/query_range",
+                start,
+                end,
+                service_account_id,
+                options,
+                secret_data,
+            ),
+            self._get_cluster_info_async(
+                f"{secret_data['mimir_endpoint']}/api/v1/query",
+                start,
+                service_account_id,
+                secret_data,
+                task_options,
+            ),
+            return_exceptions=True,
+        )
+
+    async def _check_resource_group_async(self, domain_id: str, options: dict):
+        if options.get("resource_group", None) == "DOMAIN":
+            response = await self.async_spaceone_connector.list_agents()
+            self._has_agent(response, domain_id)
+        elif options.get("resource_group", None) == "WORKSPACE":
+            workspace_id = options.get("workspace_id", None)
+            response = await self.async_spaceone_connector.list_agents(workspace_id)
+            self._has_agent(response, workspace_id)
+
+    async def _get_cluster_info_async(
+        self,
+        prometheus_query_endpoint: str,
+        start: str,
+        service_account_id: str,
+        secret_data: dict,
+        task_options: dict,
+    ) -> dict:
+        if cluster_info := task_options.get("cluster_info"):
+            return cluster_info
+
+        if self.service_account_ids:
+            return task_options.get(
+                "cluster_infos"
+            ) or await self.async_mimir_connector.list_kubecost_cluster_infos(
+                prometheus_query_endpoint, self.service_account_ids, secret_data
+            )
+
+        return await self.async_mimir_connector.get_kubecost_cluster_info(
+            prometheus_query_endpoint, start, service_account_id, secret_data
+        )
+
+    def _get_promql_response(
+        self,
+        prometheus_query_range_endpoint: str,
+        start: str,
+        end: Union[str, None],
+        service_account_id: str,
+        options: dict,
+        secret_data: dict,
+    ) -> Union[List[dict], Iterator[dict], None]:
+        result_cache, cache_key, cached_response = self._read_result_cache(
+            prometheus_query_range_endpoint,
+            start,
+            end,
+            service_account_id,
+            options,
+            secret_data,
+        )
+        if cached_response is not None:
+            return cached_response
+
+        promql_response = self._query_promql_response(
+            prometheus_query_range_endpoint,
+            start,
+            end,
+            service_account_id,
+            options,
+            secret_data,
+        )
+
+        return self._write_result_cache(result_cache, cache_key, promql_response)
+
+    async def _get_promql_response_async(
+        self,
+        prometheus_query_range_endpoint: str,
+        start: str,
+        end: Union[str, None],
+        service_account_id: str,
+        options: dict,
+        secret_data: dict,
+    ) -> Union[List[dict], Iterator[dict], None]:
+        result_cache, cache_key, cached_response = self._read_result_cache(
+            prometheus_query_range_endpoint,
+            start,
+            end,
+            service_account_id,
+            options,
+            secret_data,
+        )
+        if cached_response is not None:
+            return cached_response
+
+        promql_response = await self._query_promql_response_async(
+            prometheus_query_range_endpoint,
+            start,
+            end,
+            service_account_id,
+            options,
+            secret_data,
+        )
+
+        return self._write_result_cache(result_cache, cache_key, promql_response)
+
+    def _read_result_cache(
+        self,
+        prometheus_query_range_endpoint: str,
+        start: str,
+        end: Union[str, None],
+        service_account_id: str,
+        options: dict,
+        secret_data: dict,
+    ) -> Tuple[Union[ResultCache, None], Union[str, None], Union[Iterator[dict], None]]:
+        result_cache_options = options.get("result_cache")
+        if result_cache_options is None or not self._is_final_window(
+            start,
+            end,
+            int(
+                result_cache_options.get(
+                    "final_after_days", _DEFAULT_RESULT_CACHE_FINAL_AFTER_DAYS
+                )
+            ),
+        ):
+            return None, None, None
+
+        result_cache = ResultCache(
+            result_cache_options.get("path"), result_cache_options.get("max_size_mb")
+        )
+        if component_queries := options.get("component_queries"):
+            promql = json.dumps(component_queries, sort_keys=True)
+        else:
+            promql = secret_data["promql"]
+
+        cache_key = result_cache.make_key(
+            service_account_id,
+            prometheus_query_range_endpoint,
+            promql,
+            start,
+            end,
+            self.mimir_connector.query_step,
+            self._get_result_cache_options(options),
+        )
+
+        if (cached_response := result_cache.read(cache_key)) is not None:
+            _LOGGER.debug(f"[get_data] result cache hit: {service_account_id} {start}")
+            cached_response = self._peek_response_stream(cached_response)
+
+        return result_cache, cache_key, cached_response
+
+    def _write_result_cache(
+        self,
+        result_cache: Union[ResultCache, None],
+        cache_key: Union[str, None],
+        promql_response: Union[List[dict], Iterator[dict], None],
+    ) -> Union[List[dict], Iterator[dict], None]:
+        if result_cache is None or not promql_response:
+            return promql_response
+
+        return self._peek_response_stream(
+            result_cache.write_through(
+                cache_key,
+                promql_response,
+                is_complete=lambda: not self._get_failed_ranges(),
+            )
+        )
+
+    @staticmethod
+    def _get_result_cache_options(options: dict) -> dict:
+        # Options other than the promql and step that change which series the
+        # query returns. Cached responses are stored before reduce_rows, so
+        # that option does not belong here.
+        return {
+            "aggregation_level": options.get("aggregation_level"),
+            "label_matchers": (options.get("query_shard") or {}).get("label_matchers"),
+        }
+
+    @staticmethod
+    def _is_final_window(
+        start: str, end: Union[str, None], final_after_days: int
+    ) -> bool:
+        """Return whether the queried window ended final_after_days ago.
+
+        The window runs through the end date, or through the end of start's
+        month without one. Late samples keep arriving after a window ends, and
+        those are re-synced until the sync window has moved past it.
+        """
+        if end:
+            try:
+                last_day = datetime.strptime(end, "%Y-%m")
+            except ValueError:
+                last_day = datetime.strptime(end[: len("YYYY-MM-DD")], "%Y-%m-%d")
+            window_end = last_day + timedelta(days=1)
+        else:
+            month_start = datetime.strptime(start[: len("YYYY-MM")], "%Y-%m")
+            window_end = (month_start + timedelta(days=32)).replace(day=1)
+
+        return datetime.utcnow() >= window_end + timedelta(days=final_after_days)
+
+    def _query_promql_response(
+        self,
+        prometheus_query_range_endpoint: str,
+        start: str,
+        end: Union[str, None],
+        service_account_id: str,
+        options: dict,
+        secret_data: dict,
+    ) -> Union[List[dict], Iterator[dict], None]:
+        if component_queries := options.get("component_queries"):
+            return self.mimir_connector.get_component_promql_response(
+                prometheus_query_range_endpoint,
+                start,
+                service_account_id,
+                component_queries,
+                end=end,
+            )
+        elif query_shard := options.get("query_shard"):
+            return self._peek_response_stream(
+                self.mimir_connector.get_sharded_promql_response(
+                    prometheus_query_range_endpoint,
+                    start,
+                    service_account_id,
+                    secret_data["promql"],
+                    query_shard,
+                    end=end,
+                )
+            )
+        elif options.get("stream_response", False):
+            return self._peek_response_stream(
+                self.mimir_connector.stream_promql_response(
+                    prometheus_query_range_endpoint,
+                    start,
+                    service_account_id,
+                    secret_data["promql"],
+                    end=end,
+                )
+            )
+        else:
+            return self.mimir_connector.get_promql_response(
+                prometheus_query_range_endpoint,
+                start,
+                service_account_id,
+                secret_data["promql"],
+                end=end,
+            )
+
+    async def _query_promql_response_async(
+        self,
+        prometheus_query_range_endpoint: str,
+        start: str,
+        end: Union[str, None],
+        service_account_id: str,
+        options: dict,
+        secret_data: dict,
+    ) -> Union[List[dict], Iterator[dict], None]:
+        if component_queries := options.get("component_queries"):
+            return await self.async_mimir_connector.get_component_promql_response(
+                prometheus_query_range_endpoint,
+                start,
+                service_account_id,
+                component_queries,
+                end=end,
+            )
+        elif query_shard := options.get("query_shard"):
+            return await self.async_mimir_connector.get_sharded_promql_response(
+                prometheus_query_range_endpoint,
+                start,
+                service_account_id,
+                secret_data["promql"],
+                query_shard,
+                end=end,
+            )
+        elif options.get("stream_response", False):
+            # The streamed body is consumed by the caller's thread, so only the
+            # request itself is moved off the event loop.
+            return await asyncio.get_running_loop().run_in_executor(
+                None,
+                lambda: self._query_promql_response(
+                    prometheus_query_range_endpoint,
+                    start,
+                    end,
+                    service_account_id,
+                    options,
+                    secret_data,
+                ),
+            )
+        else:
+            return await self.async_mimir_connector.get_promql_response(
+                prometheus_query_range_endpoint,
+                start,
+                service_account_id,
+                secret_data["promql"],
+                end=end,
+            )
+
+    def _get_failed_ranges(self) -> List[dict]:
+        return (
+            self.mimir_connector.failed_ranges
+            + self.async_mimir_connector.failed_ranges
+        )
+
+    def _check_failed_ranges(self, service_account_id: str) -> None:
+        if failed_ranges := self._get_failed_ranges():
+            _LOGGER.error(
+                f"[get_data] query ranges failed permanently: {failed_ranges}"
+            )
+            raise ERROR_MIMIR_QUERY_RANGE_FAILED(
+                service_account_id=service_account_id, failed_ranges=failed_ranges
+            )
+
     def _check_resource_group(self, domain_id: str, options: dict):
         if options.get("resource_group", None) == "DOMAIN":
             response = self.spaceone_connector.list_agents()
@@ -135,67 +649,292 @@ class CostManager(BaseManager):
                 )
             yield {"results": []}
 
+    @staticmethod
+    def _peek_response_stream(
+        response_stream: Generator[dict, None, None]
+    ) -> Union[Iterator[dict], None]:
+        first_result = next(response_stream, None)
+
+        if first_result is None:
+            return None
+
+        return chain([first_result], response_stream)
+
     def _process_response_stream(
         self,
         cluster_info: dict,
         service_account_id: str,
         promql_response_stream: Generator,
     ) -> Generator[dict, None, None]:
-        for results in promql_response_stream:
-            yield self._make_cost_data(results, cluster_info, service_account_id)
+        if self.pipeline_prefetch_pages:
+            # Fetching/decoding/paging and transforming run in threads of their
+            # own, each stage at most pipeline_prefetch_pages pages ahead.
+            promql_response_stream = pipeline.prefetch(
+                promql_response_stream, self.pipeline_prefetch_pages, "fetch"
+            )
+
+        transformed_pages = self._transform_pages(
+            cluster_info, service_account_id, promql_response_stream
+        )
+        if self.pipeline_prefetch_pages:
+            transformed_pages = pipeline.prefetch(
+                transformed_pages, self.pipeline_prefetch_pages, "transform"
+            )
 
+        series_count, row_count = 0, 0
+        for page_series_count, cost_data in transformed_pages:
+            series_count += page_series_count
+            row_count += len(cost_data["results"])
+
+            # Time spent while suspended here is the consumer writing the page.
+            started_at = time.perf_counter()
+            yield cost_data
+            metrics.observe_stage(
+                _METRIC_ROUTE,
+                service_account_id,
+                "emit",
+                time.perf_counter() - started_at,
+            )
+
+        metrics.observe_task(_METRIC_ROUTE, service_account_id, series_count, row_count)
         yield {"results": []}
 
-    def _make_cost_data(
+    def _transform_pages(
         self,
-        results: List[dict],
+        cluster_info: dict,
+        service_account_id: str,
+        promql_response_stream: Generator,
+    ) -> Generator[Tuple[int, dict], None, None]:
+        """Yield (series count, cost data) per page, in page order.
+
+        With options.transform_workers, pages of at least
+        transform_offload_min_rows samples are transformed in a process pool
+        while later pages are read, keeping up to two pages per worker in
+        flight. Smaller pages are cheaper to transform than to pickle and are
+        handled in this process. Pages of a federated task are split into one
+        page per tenant.
+        """
+        max_workers = self.transform_workers
+        pending = deque()
+
+        try:
+            for page in promql_response_stream:
+                for results, tenant_id, tenant_cluster_info in self._split_page(
+                    page, service_account_id, cluster_info
+                ):
+                    transform_args = (
+                        results,
+                        tenant_cluster_info,
+                        tenant_id,
+                        self.additional_info_labels,
+                    )
+                    if max_workers > 0 and (
+                        sum(map(len, results)) >= self.transform_offload_min_rows
+                    ):
+                        future = get_process_pool(max_workers).submit(
+                            _transform_page, *transform_args
+                        )
+                    else:
+                        future = Future()
+                        future.set_result(_transform_page(*transform_args))
+
+                    pending.append((len(results), future))
+
+                while pending and (
+                    len(pending) > max_workers * 2 or pending[0][1].done()
+                ):
+                    yield self._get_transformed_page(
+                        service_account_id, *pending.popleft()
+                    )
+
+            while pending:
+                yield self._get_transformed_page(service_account_id, *pending.popleft())
+        finally:
+            for _, future in pending:
+                future.cancel()
+
+    def _split_page(
+        self, results: List[Series], service_account_id: str, cluster_info: dict
+    ) -> List[Tuple[List[Series], str, dict]]:
+        """Return (series, X-Scope-OrgID, cluster info) for each tenant of the
+        page, so that rows are keyed by their own tenant.
+        """
+        if not self.service_account_ids:
+            return [(results, service_account_id, cluster_info)]
+
+        cluster_infos = cluster_info or {}
+        return [
+            (tenant_results, tenant_id, cluster_infos.get(tenant_id, {}))
+            for tenant_id, tenant_results in self.mimir_connector.group_series_by_tenant(
+                results, self.service_account_ids
+            ).items()
+        ]
+
+    @staticmethod
+    def _get_transformed_page(
+        service_account_id: str, page_series_count: int, future: Future
+    ) -> Tuple[int, dict]:
+        cost_data, transform_seconds = future.result()
+        metrics.observe_stage(
+            _METRIC_ROUTE, service_account_id, "transform", transform_seconds
+        )
+
+        return page_series_count, cost_data
+
+    def _reduce_response(
+        self, promql_response: Iterable[Union[Series, dict]], service_account_id: str
+    ) -> Generator[Series, None, None]:
+        """Reduce the whole response before it is paged.
+
+        Duplicate rows can be far apart in the response, so they are merged
+        across page boundaries; this holds the reduced series of the task in
+        memory, also with options.stream_response. Series of a federated task
+        are reduced per tenant. Runs on the first read, i.e. in the fetch stage
+        of the pipeline.
+        """
+        with metrics.stage_timer(_METRIC_ROUTE, service_account_id, "reduce"):
+            results = map(Series.from_result, promql_response)
+            if self.service_account_ids:
+                reduced = [
+                    series
+                    for tenant_id, tenant_results in self.mimir_connector.group_series_by_tenant(
+                        results, self.service_account_ids
+                    ).items()
+                    for series in self._reduce_series(tenant_results, tenant_id)
+                ]
+            else:
+                reduced = self._reduce_series(results, service_account_id)
+
+        yield from reduced
+
+    def _reduce_series(
+        self, results: Iterable[Series], service_account_id: str
+    ) -> List[Series]:
+        """Drop zero/NaN samples and merge duplicate rows of one tenant.
+
+        Rows are duplicates when they share billed_date, additional_info and
+        usage_type, e.g. series that differ only in labels not emitted at the
+        current aggregation level. Their costs are summed into one row.
+        """
+        groups = {}
+        zero_rows, input_rows = 0, 0
+        for series in results:
+            input_rows += len(series)
+
+            additional_info = self._make_additional_info(
+                series, service_account_id, self.additional_info_labels
+            )
+            key = (series.metric.get("type"), tuple(additional_info.items()))
+            first_series, samples = groups.setdefault(key, (series, {}))
+
+            for timestamp, cost, usage_quantity in zip(
+                series.timestamps, series.costs, self._get_usage_quantities(series)
+            ):
+                if not cost or math.isnan(cost):
+                    zero_rows += 1
+                    continue
+
+                # Samples on the same UTC day end up on the same billed_date.
+                day = timestamp // _SECONDS_PER_DAY
+                if day in samples:
+                    samples[day][1] += cost
+                    samples[day][2] += usage_quantity
+                else:
+                    samples[day] = [timestamp, cost, usage_quantity]
+
+        reduced = [
+            Series(
+                first_series.metric,
+                array("d", [sample[0] for sample in samples.values()]),
+                array("d", [sample[1] for sample in samples.values()]),
+                first_series.usage_quantity,
+                first_series.usage_unit,
+                first_series.tags,
+                (
+                    array("d", [sample[2] for sample in samples.values()])
+                    if first_series.usage_quantities is not None
+                    else None
+                ),
+            )
+            for first_series, samples in groups.values()
+            if samples
+        ]
+
+        merged_rows = input_rows - zero_rows - sum(len(series) for series in reduced)
+        metrics.count_removed_rows(
+            _METRIC_ROUTE, service_account_id, "zero_cost", zero_rows
+        )
+        metrics.count_removed_rows(
+            _METRIC_ROUTE, service_account_id, "duplicate", merged_rows
+        )
+
+        return reduced
+
+    @classmethod
+    def _make_cost_data(
+        cls,
+        results: List[Series],
         cluster_info: dict,
         x_scope_orgid: str,
+        additional_info_labels: List[str],
     ) -> dict:
         cluster_metric = (
             cluster_info.get("data", {}).get("result", [{}])[0].get("metric", {})
         )
+        product = cluster_metric.get("provisioner", "kubernetes")
+        region_code = cls._get_region_code(cluster_metric.get("region", "Unknown"))
+
+        billed_dates = cls._convert_billed_dates(
+            chain.from_iterable(series.timestamps for series in results)
+        )
+
         costs_data = []
-        for result in results:
-            for i in range(len(result["values"])):
-                additional_info = self._make_additional_info(result, x_scope_orgid)
-
-                data = {}
-                idle = result["metric"].get("type") == "idle"
-                load_balancer = result["metric"].get("type") == "Load Balancer"
-                if (not idle) and (not load_balancer):
-                    data["usage_type"] = result["metric"].get("type")
-
-                result["cost"] = float(result["values"][i][1])
-                result["billed_date"] = pd.to_datetime(
-                    result["values"][i][0], unit="s"
-                ).strftime("%Y-%m-%d")
-
-                try:
-                    data.update(
-                        {
-                            "cost": result.get("cost"),
-                            "billed_date": result["billed_date"],
-                            "product": cluster_metric.get("provisioner", "kubernetes"),
-                            "provider": "kubernetes",
-                            "region_code": self._get_region_code(
-                                cluster_metric.get("region", "Unknown")
-                            ),
-                            "usage_quantity": result.get("usage_quantity", 0),
-                            "usage_unit": result.get("usage_unit"),
-                            "additional_info": additional_info,
-                            "tags": result.get("tags", {}),
-                        }
-                    )
-                except Exception as e:
-                    _LOGGER.error(
-                        f"[_make_cost_data] make data error: {e}", exc_info=True
-                    )
-                    raise e
+        for series in results:
+            # Rows of a series share one additional_info and tags dict. They are
+            # never mutated here and the response model copies them anyway.
+            additional_info = cls._make_additional_info(
+                series, x_scope_orgid, additional_info_labels
+            )
+            usage_type = series.metric.get("type")
+            has_usage_type = usage_type not in ["idle", "Load Balancer"]
+
+            for timestamp, cost, usage_quantity in zip(
+                series.timestamps, series.costs, cls._get_usage_quantities(series)
+            ):
+                data = {"usage_type": usage_type} if has_usage_type else {}
+                data.update(
+                    {
+                        "cost": cost,
+                        "billed_date": billed_dates[timestamp],
+                        "product": product,
+                        "provider": "kubernetes",
+                        "region_code": region_code,
+                        "usage_quantity": usage_quantity,
+                        "usage_unit": series.usage_unit,
+                        "additional_info": additional_info,
+                        "tags": series.tags,
+                    }
+                )
                 costs_data.append(data)
 
         return {"results": costs_data}
 
+    @staticmethod
+    def _get_usage_quantities(series: Series) -> Iterable[float]:
+        if series.usage_quantities is None:
+            return repeat(series.usage_quantity)
+
+        return series.usage_quantities
+
+    @staticmethod
+    def _convert_billed_dates(timestamps: Iterable[float]) -> dict:
+        return {
+            timestamp: datetime.fromtimestamp(float(timestamp), timezone.utc).strftime(
+                "%Y-%m-%d"
+            )
+            for timestamp in dict.fromkeys(timestamps)
+        }
+
     @staticmethod
     def _strip_dict_keys(result: dict) -> dict:
         return {
@@ -217,33 +956,18 @@ class CostManager(BaseManager):
                 raise ERROR_REQUIRED_PARAMETER(key=field)
 
     @staticmethod
-    def _make_additional_info(result: dict, service_account_id: str) -> dict:
+    def _make_additional_info(
+        series: Series, service_account_id: str, labels: List[str]
+    ) -> dict:
         additional_info = {
             "X-Scope-OrgID": service_account_id,
         }
 
-        if cluster := result["metric"].get("cluster"):
-            additional_info["Cluster"] = cluster
-
-        if node := result["metric"].get("node"):
-            additional_info["Node"] = node
-
-        if namespace := result["metric"].get("namespace"):
-            additional_info["Namespace"] = namespace
-
-        if pod := result["metric"].get("pod"):
-            additional_info["Pod"] = pod
+        for label in labels:
+            if value := series.metric.get(label):
+                additional_info[_ADDITIONAL_INFO_LABELS[label]] = value
 
-        if container := result["metric"].get("container"):
-            additional_info["Container"] = container
-
-        if pv := result["metric"].get("persistentvolume"):
-            additional_info["PV"] = pv
-
-        if service := result["metric"].get("service_name"):
-            additional_info["Load Balancer"] = service
-
-        if result["metric"].get("type") == "idle":
+        if series.metric.get("type") == "idle":
             additional_info["Idle"] = "__idle__"
 
         return additional_info
@@ -253,3 +977,18 @@ class CostManager(BaseManager):
         region_name = AWS_REGION_MAP.get(region, "Unknown")
 
         return region_name
+
+
+def _transform_page(
+    results: List[Series],
+    cluster_info: dict,
+    x_scope_orgid: str,
+    additional_info_labels: List[str],
+) -> Tuple[dict, float]:
+    # Module level so that process pool workers can unpickle it by name.
+    started_at = time.perf_counter()
+    cost_data = CostManager._make_cost_data(
+        results, cluster_info, x_scope_orgid, additional_info_labels
+    )
+
+    return cost_data, time.perf_counter() - started_at
@@ -1,21 +1,49 @@
+import asyncio
+import calendar
 import logging
+import math
+import time
 from datetime import datetime, timedelta
+from typing import List, Tuple, Union
 
-import pandas as pd
 from spaceone.core.error import ERROR_INVALID_PARAMETER_TYPE
 from spaceone.core.manager import BaseManager
 
+from ..connector.async_mimir_connector import AsyncMimirConnector
+from ..connector.async_spaceone_connector import AsyncSpaceONEConnector
 from ..connector.mimir_connector import MimirConnector
 from ..connector.spaceone_connector import SpaceONEConnector
+from ..lib import async_http, metrics
+from ..lib.cache import TTLCache
 
 _LOGGER = logging.getLogger(__name__)
 
+_METRIC_ROUTE = "Job.get_tasks"
+
+_DEFAULT_INCREMENTAL_LOOKBACK_DAYS = 1
+_DEFAULT_SERIES_PER_TASK = 20000
+_DEFAULT_MAX_MONTHS_PER_TASK = 12
+_DEFAULT_MAX_TENANTS_PER_TASK = 20
+_SERVICE_ACCOUNT_NAME_CACHE = TTLCache(maxsize=10000)
+
 
 class JobManager(BaseManager):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.mimir_connector: MimirConnector = MimirConnector()
         self.spaceone_connector: SpaceONEConnector = SpaceONEConnector()
+        self.service_account_names = {}
+        self.cluster_infos = {}
+        self.series_counts = {}
+        self.async_mimir_connector: AsyncMimirConnector = AsyncMimirConnector()
+        self.async_spaceone_connector: AsyncSpaceONEConnector = AsyncSpaceONEConnector()
+        for connector in [
+            self.mimir_connector,
+            self.spaceone_connector,
+            self.async_mimir_connector,
+            self.async_spaceone_connector,
+        ]:
+            connector.metric_route = _METRIC_ROUTE
 
     def get_tasks(
         self,
@@ -27,37 +55,48 @@ class JobManager(BaseManager):
         last_synchronized_at: datetime = None,
     ):
         self.spaceone_connector.init_client(options, secret_data, schema)
+        self.spaceone_connector.metric_tenant = domain_id
+        started_at = time.perf_counter()
 
-        tasks, changed = [], []
+        tasks, changed, agents_info = [], [], {}
         resource_group = options.get("resource_group", None)
         if resource_group == "DOMAIN":
             agents_info = self.spaceone_connector.list_agents()
 
             self._check_agent_exist(agents_info, domain_id, None)
+            self._load_agent_details(
+                domain_id, options, secret_data, schema, agents_info
+            )
 
-            for response in agents_info.get("results", []):
-                sub_tasks, sub_changed = self._get_response_by_agents(
-                    response,
-                    start,
-                    last_synchronized_at,
-                )
-                tasks.extend(sub_tasks)
-                changed.extend(sub_changed)
+            tasks, changed = self._get_tasks_by_agents(
+                agents_info.get("results", []),
+                start,
+                last_synchronized_at,
+                options,
+            )
 
         elif resource_group == "WORKSPACE":
             workspace_id = options.get("workspace_id", None)
             agents_info = self.spaceone_connector.list_agents(workspace_id=workspace_id)
 
             self._check_agent_exist(agents_info, None, workspace_id)
+            self._load_agent_details(
+                domain_id, options, secret_data, schema, agents_info
+            )
 
-            for response in agents_info.get("results", []):
-                sub_tasks, sub_changed = self._get_response_by_agents(
-                    response,
-                    start,
-                    last_synchronized_at,
-                )
-                tasks.extend(sub_tasks)
-                changed.extend(sub_changed)
+            tasks, changed = self._get_tasks_by_agents(
+                agents_info.get("results", []),
+                start,
+                last_synchronized_at,
+                options,
+            )
+
+        metrics.observe_stage(
+            _METRIC_ROUTE, domain_id, "get_tasks", time.perf_counter() - started_at
+        )
+        metrics.observe_task(
+            _METRIC_ROUTE, domain_id, len(agents_info.get("results", [])), len(tasks)
+        )
 
         _LOGGER.debug(f"Tasks: {tasks}, Changed: {changed}")
         return {"tasks": tasks, "changed": changed}
@@ -73,21 +112,312 @@ class JobManager(BaseManager):
                 )
             return {"tasks": [], "changed": []}
 
-    def _get_response_by_agents(
+    def _get_tasks_by_agents(
         self,
-        response: dict,
+        agents: List[dict],
+        start: str,
+        last_synchronized_at: datetime,
+        options: dict,
+    ) -> Tuple[list, list]:
+        if (tenant_federation := options.get("tenant_federation")) is not None:
+            agent_groups = self._group_small_tenants(agents, tenant_federation)
+        else:
+            agent_groups = [[agent] for agent in agents]
+
+        tasks, changed = [], []
+        for agent_group in agent_groups:
+            sub_tasks, sub_changed = self._get_response_by_agent_group(
+                agent_group, start, last_synchronized_at, options
+            )
+            tasks.extend(sub_tasks)
+            changed.extend(sub_changed)
+
+        return tasks, changed
+
+    def _group_small_tenants(
+        self, agents: List[dict], tenant_federation: dict
+    ) -> List[List[dict]]:
+        """Pack active agents of small tenants into groups of up to
+        max_tenants_per_task agents and series_per_task series in total.
+
+        Each group becomes one task querying all of its tenants through Mimir
+        tenant federation. Agents whose series count is unknown or too large
+        for sharing a task stay in groups of their own. Groups keep the order
+        of their first agent.
+        """
+        series_per_task = int(
+            tenant_federation.get("series_per_task", _DEFAULT_SERIES_PER_TASK)
+        )
+        max_tenants = int(
+            tenant_federation.get("max_tenants_per_task", _DEFAULT_MAX_TENANTS_PER_TASK)
+        )
+
+        agent_groups, group, group_series, grouped_ids = [], None, 0, set()
+        for agent in agents:
+            service_account_id = agent.get("service_account_id")
+            series_count = self.series_counts.get(service_account_id)
+
+            if (
+                not self._is_active_agent(agent)
+                or series_count is None
+                or series_count >= series_per_task
+                or service_account_id in grouped_ids
+            ):
+                agent_groups.append([agent])
+                continue
+
+            if (
+                group is None
+                or len(group) >= max_tenants
+                or group_series + series_count > series_per_task
+            ):
+                group, group_series = [], 0
+                agent_groups.append(group)
+
+            group.append(agent)
+            group_series += series_count
+            grouped_ids.add(service_account_id)
+
+        return agent_groups
+
+    def _load_agent_details(
+        self,
+        domain_id: str,
+        options: dict,
+        secret_data: dict,
+        schema: str,
+        agents_info: dict,
+    ) -> None:
+        if not options.get("async_io", False):
+            self._load_service_account_names(domain_id, options, agents_info)
+            self._load_cluster_infos(options, secret_data, schema, agents_info)
+            self._load_series_counts(options, secret_data, schema, agents_info)
+            return
+
+        self.async_spaceone_connector.init_client(options, secret_data, schema)
+        self.async_spaceone_connector.metric_tenant = domain_id
+
+        async def _load():
+            # Names come from SpaceONE, cluster infos and series counts from
+            # Mimir, so the lookups overlap.
+            await asyncio.gather(
+                self._load_service_account_names_async(domain_id, options, agents_info),
+                self._load_cluster_infos_async(
+                    options, secret_data, schema, agents_info
+                ),
+                self._load_series_counts_async(
+                    options, secret_data, schema, agents_info
+                ),
+            )
+
+        async_http.run(_load())
+
+    def _load_service_account_names(
+        self, domain_id: str, options: dict, agents_info: dict
+    ) -> None:
+        missing_ids = self._get_missing_service_account_ids(
+            domain_id, options, agents_info
+        )
+        if not missing_ids:
+            return
+
+        response = self.spaceone_connector.list_service_accounts_by_ids(missing_ids)
+        self._set_service_account_names(domain_id, options, response)
+
+    async def _load_service_account_names_async(
+        self, domain_id: str, options: dict, agents_info: dict
+    ) -> None:
+        missing_ids = self._get_missing_service_account_ids(
+            domain_id, options, agents_info
+        )
+        if not missing_ids:
+            return
+
+        response = await self.async_spaceone_connector.list_service_accounts_by_ids(
+            missing_ids
+        )
+        self._set_service_account_names(domain_id, options, response)
+
+    def _get_missing_service_account_ids(
+        self, domain_id: str, options: dict, agents_info: dict
+    ) -> List[str]:
+        cache_ttl = options.get("service_account_cache_ttl", 0)
+        service_account_ids = self._get_service_account_ids(agents_info)
+
+        missing_ids = []
+        for service_account_id in service_account_ids:
+            name = None
+            if cache_ttl:
+                name = _SERVICE_ACCOUNT_NAME_CACHE.get((domain_id, service_account_id))
+
+            if name is None:
+                missing_ids.append(service_account_id)
+            else:
+                self.service_account_names[service_account_id] = name
+
+        return missing_ids
+
+    def _set_service_account_names(
+        self, domain_id: str, options: dict, response: dict
+    ) -> None:
+        cache_ttl = options.get("service_account_cache_ttl", 0)
+        for service_account_info in response.get("results", []):
+            service_account_id = service_account_info["service_account_id"]
+            name = service_account_info.get("name")
+
+            self.service_account_names[service_account_id] = name
+            if cache_ttl:
+                _SERVICE_ACCOUNT_NAME_CACHE.set(
+                    (domain_id, service_account_id), name, ttl=cache_ttl
+                )
+
+    def _load_cluster_infos(
+        self, options: dict, secret_data: dict, schema: str, agents_info: dict
+    ) -> None:
+        if not options.get("batch_cluster_info", False):
+            return
+
+        self.mimir_connector.init_client(options, secret_data, schema)
+
+        service_account_ids = self._get_service_account_ids(agents_info)
+        prometheus_query_endpoint = f"{secret_data['mimir_endpoint']}/api/v1/query"
+
+        self.cluster_infos = self.mimir_connector.list_kubecost_cluster_infos(
+            prometheus_query_endpoint, service_account_ids, secret_data
+        )
+
+    async def _load_cluster_infos_async(
+        self, options: dict, secret_data: dict, schema: str, agents_info: dict
+    ) -> None:
+        if not options.get("batch_cluster_info", False):
+            return
+
+        self.async_mimir_connector.init_client(options, secret_data, schema)
+
+        service_account_ids = self._get_service_account_ids(agents_info)
+        prometheus_query_endpoint = f"{secret_data['mimir_endpoint']}/api/v1/query"
+
+        self.cluster_infos = (
+            await self.async_mimir_connector.list_kubecost_cluster_infos(
+                prometheus_query_endpoint, service_account_ids, secret_data
+            )
+        )
+
+    def _load_series_counts(
+        self, options: dict, secret_data: dict, schema: str, agents_info: dict
+    ) -> None:
+        if not self._needs_series_counts(options):
+            return
+
+        self.mimir_connector.init_client(options, secret_data, schema)
+
+        service_account_ids = self._get_service_account_ids(agents_info)
+        prometheus_query_endpoint = f"{secret_data['mimir_endpoint']}/api/v1/query"
+
+        self.series_counts = self.mimir_connector.list_series_counts(
+            prometheus_query_endpoint,
+            service_account_ids,
+            self._get_planning_promql(options, secret_data),
+        )
+
+    async def _load_series_counts_async(
+        self, options: dict, secret_data: dict, schema: str, agents_info: dict
+    ) -> None:
+        if not self._needs_series_counts(options):
+            return
+
+        self.async_mimir_connector.init_client(options, secret_data, schema)
+
+        service_account_ids = self._get_service_account_ids(agents_info)
+        prometheus_query_endpoint = f"{secret_data['mimir_endpoint']}/api/v1/query"
+
+        self.series_counts = await self.async_mimir_connector.list_series_counts(
+            prometheus_query_endpoint,
+            service_account_ids,
+            self._get_planning_promql(options, secret_data),
+        )
+
+    @staticmethod
+    def _needs_series_counts(options: dict) -> bool:
+        return (
+            options.get("task_planning") is not None
+            or options.get("tenant_federation") is not None
+        )
+
+    def _get_planning_promql(self, options: dict, secret_data: dict) -> str:
+        # Count the series Cost.get_data will actually receive.
+        promql = secret_data.get("promql", "")
+        if aggregation_level := options.get("aggregation_level"):
+            self.mimir_connector.check_aggregation_level(aggregation_level)
+            promql = self.mimir_connector.aggregate_promql(promql, aggregation_level)
+
+        return promql
+
+    @staticmethod
+    def _get_service_account_ids(agents_info: dict) -> List[str]:
+        return list(
+            dict.fromkeys(
+                agent["service_account_id"]
+                for agent in agents_info.get("results", [])
+                if agent.get("service_account_id")
+            )
+        )
+
+    def _get_service_account_name(self, service_account_id: str) -> str:
+        if service_account_id not in self.service_account_names:
+            self.service_account_names[service_account_id] = (
+                self.spaceone_connector.get_service_account(service_account_id).get(
+                    "name"
+                )
+            )
+
+        return self.service_account_names[service_account_id]
+
+    def _get_response_by_agent_group(
+        self,
+        agents: List[dict],
         start: str,
         last_synchronized_at: datetime,
+        options: dict,
     ):
+        if len(agents) == 1:
+            return self._get_response_by_agents(
+                agents[0], start, last_synchronized_at, options
+            )
+
+        date_windows = self._get_date_windows(start, last_synchronized_at, options)
+        if (task_planning := options.get("task_planning")) is not None:
+            date_windows = self._plan_date_windows(
+                sum(
+                    self.series_counts[agent["service_account_id"]] for agent in agents
+                ),
+                date_windows,
+                task_planning,
+            )
+
+        return self._generate_federated_tasks(agents, date_windows)
+
+    @staticmethod
+    def _is_active_agent(response: dict) -> bool:
         state = response.get("state", "DISABLED")
         last_accessed_at = response.get("last_accessed_at", None)
 
+        return state == "ENABLED" and bool(last_accessed_at)
+
+    def _get_response_by_agents(
+        self,
+        response: dict,
+        start: str,
+        last_synchronized_at: datetime,
+        options: dict,
+    ):
         tasks, changed = [], []
-        if state == "ENABLED" and last_accessed_at:
+        if self._is_active_agent(response):
             tasks, changed = self._get_tasks_changed(
                 response,
                 start,
                 last_synchronized_at,
+                options,
             )
 
         return tasks, changed
@@ -97,12 +427,34 @@ class JobManager(BaseManager):
         response: dict,
         start: str,
         last_synchronized_at: datetime,
+        options: dict,
     ):
-        start_month = self._get_start_month(start, last_synchronized_at)
-        tasks, changed = self._generate_tasks(response, start_month)
+        date_windows = self._get_date_windows(start, last_synchronized_at, options)
+
+        if (task_planning := options.get("task_planning")) is not None:
+            date_windows = self._plan_date_windows(
+                self.series_counts.get(response["service_account_id"]),
+                date_windows,
+                task_planning,
+            )
+
+        tasks, changed = self._generate_tasks(response, date_windows)
 
         return tasks, changed
 
+    def _get_date_windows(
+        self, start: str, last_synchronized_at: datetime, options: dict
+    ) -> List[Tuple[str, Union[str, None]]]:
+        if (
+            options.get("incremental_sync", False)
+            and last_synchronized_at
+            and not start
+        ):
+            return self._get_incremental_date_windows(last_synchronized_at, options)
+
+        start_month = self._get_start_month(start, last_synchronized_at)
+        return self._get_month_date_windows(start_month)
+
     def _get_start_month(self, start, last_synchronized_at=None):
         if start:
             start_time: datetime = self.__parse_start_time(start)
@@ -119,32 +471,245 @@ class JobManager(BaseManager):
 
         return start_time.strftime("%Y-%m")
 
-    def _generate_tasks(self, response, start_month):
-        end_time = datetime.utcnow()
-        date_range = pd.date_range(start=start_month, end=end_time, freq="MS").strftime(
-            "%Y-%m"
+    @staticmethod
+    def _get_month_date_windows(start_month: str) -> List[Tuple[str, None]]:
+        month_start = datetime.strptime(start_month, "%Y-%m").date()
+        today = datetime.utcnow().date()
+
+        date_windows = []
+        while month_start <= today:
+            date_windows.append((month_start.strftime("%Y-%m"), None))
+            month_start = (month_start + timedelta(days=32)).replace(day=1)
+
+        return date_windows
+
+    def _get_incremental_date_windows(
+        self, last_synchronized_at: datetime, options: dict
+    ) -> List[Tuple[str, None]]:
+        """Return month windows from the month lookback days before the last
+        sync up to the open month.
+
+        cost-analysis replaces the data of every billed_month in changed, so a
+        month touched by the lookback is fetched again from its first day.
+        """
+        lookback_days = int(
+            options.get("incremental_lookback_days", _DEFAULT_INCREMENTAL_LOOKBACK_DAYS)
         )
+        window_start = last_synchronized_at - timedelta(days=lookback_days)
 
-        tasks, changed = [], []
-        for date in date_range:
+        return self._get_month_date_windows(window_start.strftime("%Y-%m"))
+
+    def _plan_date_windows(
+        self,
+        series_count: Union[int, None],
+        date_windows: List[Tuple[str, Union[str, None]]],
+        task_planning: dict,
+    ) -> List[Tuple[str, Union[str, None]]]:
+        """Size the windows so that every task handles about series_per_task
+        series-months.
+
+        Tenants above the budget get each window split into day ranges, light
+        tenants get consecutive closed months merged into one task. Tenants
+        whose series count is unknown keep one task per window.
+        """
+        if series_count is None:
+            return date_windows
+
+        series_per_task = int(
+            task_planning.get("series_per_task", _DEFAULT_SERIES_PER_TASK)
+        )
+        if series_count > series_per_task:
+            split_count = math.ceil(series_count / series_per_task)
+            return [
+                sub_window
+                for start, end in date_windows
+                for sub_window in self._split_date_window(start, end, split_count)
+            ]
+
+        max_months = int(
+            task_planning.get("max_months_per_task", _DEFAULT_MAX_MONTHS_PER_TASK)
+        )
+        batch_size = min(series_per_task // max(series_count, 1), max_months)
+        if batch_size > 1:
+            return self._batch_month_windows(date_windows, batch_size)
+
+        return date_windows
+
+    @staticmethod
+    def _split_date_window(
+        start: str, end: Union[str, None], split_count: int
+    ) -> List[Tuple[str, str]]:
+        if end:
+            first_day = datetime.strptime(start, "%Y-%m-%d").date()
+            last_day = datetime.strptime(end, "%Y-%m-%d").date()
+        else:
+            first_day = datetime.strptime(start, "%Y-%m").date()
+            last_day = first_day.replace(
+                day=calendar.monthrange(first_day.year, first_day.month)[1]
+            )
+
+        # Days after today hold no data yet, leave them out of the split.
+        last_day = max(min(last_day, datetime.utcnow().date()), first_day)
+        day_count = (last_day - first_day).days + 1
+        split_count = min(split_count, day_count)
+
+        sub_windows = []
+        for index in range(split_count):
+            sub_start = first_day + timedelta(days=day_count * index // split_count)
+            sub_end = first_day + timedelta(
+                days=day_count * (index + 1) // split_count - 1
+            )
+            sub_windows.append(
+                (sub_start.strftime("%Y-%m-%d"), sub_end.strftime("%Y-%m-%d"))
+            )
+
+        return sub_windows
+
+    @staticmethod
+    def _batch_month_windows(
+        date_windows: List[Tuple[str, Union[str, None]]], batch_size: int
+    ) -> List[Tuple[str, Union[str, None]]]:
+        # Only closed months are merged. The open month is synced again on
+        # every run, so it keeps a task of its own.
+        current_month = datetime.utcnow().strftime("%Y-%m")
+
+        batched_windows, batch = [], []
+
+        def _flush():
+            if len(batch) == 1:
+                batched_windows.append((batch[0], None))
+            elif batch:
+                last_month = datetime.strptime(batch[-1], "%Y-%m").date()
+                last_day = last_month.replace(
+                    day=calendar.monthrange(last_month.year, last_month.month)[1]
+                )
+                batched_windows.append(
+                    (f"{batch[0]}-01", last_day.strftime("%Y-%m-%d"))
+                )
+            batch.clear()
+
+        for start, end in date_windows:
+            if end is None and start < current_month:
+                batch.append(start)
+                if len(batch) == batch_size:
+                    _flush()
+            else:
+                _flush()
+                batched_windows.append((start, end))
+
+        _flush()
+
+        return batched_windows
+
+    def _generate_tasks(
+        self, response: dict, date_windows: List[Tuple[str, Union[str, None]]]
+    ):
+        tasks = []
+        for date, end_date in date_windows:
             task_options = {
                 "service_account_id": response["service_account_id"],
-                "service_account_name": self.spaceone_connector.get_service_account(
+                "service_account_name": self._get_service_account_name(
                     response["service_account_id"]
-                ).get("name"),
+                ),
                 "cluster_name": response.get("options").get("cluster_name", ""),
                 "start": date,
             }
+            if end_date:
+                task_options["end"] = end_date
+
+            if cluster_info := self.cluster_infos.get(response["service_account_id"]):
+                task_options["cluster_info"] = cluster_info
+
             tasks.append({"task_options": task_options})
-            changed.append(
-                {
-                    "start": date,
-                    "filter": {"service_account_id": response["service_account_id"]},
-                }
-            )
+
+        changed = self._make_changed([response["service_account_id"]], date_windows)
 
         return tasks, changed
 
+    def _generate_federated_tasks(
+        self, agents: List[dict], date_windows: List[Tuple[str, Union[str, None]]]
+    ):
+        service_account_ids = [agent["service_account_id"] for agent in agents]
+        cluster_infos = {
+            service_account_id: self.cluster_infos[service_account_id]
+            for service_account_id in service_account_ids
+            if service_account_id in self.cluster_infos
+        }
+
+        tasks = []
+        for date, end_date in date_windows:
+            task_options = {
+                "service_account_id": "|".join(service_account_ids),
+                "service_account_ids": service_account_ids,
+                "service_account_name": ", ".join(
+                    str(self._get_service_account_name(service_account_id))
+                    for service_account_id in service_account_ids
+                ),
+                "cluster_name": ", ".join(
+                    agent.get("options").get("cluster_name", "") for agent in agents
+                ),
+                "start": date,
+            }
+            if end_date:
+                task_options["end"] = end_date
+
+            # Partial cluster infos would leave some tenants without theirs, so
+            # Cost.get_data queries them itself in that case.
+            if len(cluster_infos) == len(service_account_ids):
+                task_options["cluster_infos"] = cluster_infos
+
+            tasks.append({"task_options": task_options})
+
+        changed = self._make_changed(service_account_ids, date_windows)
+
+        return tasks, changed
+
+    def _make_changed(
+        self,
+        service_account_ids: List[str],
+        date_windows: List[Tuple[str, Union[str, None]]],
+    ) -> List[dict]:
+        changed_months = dict.fromkeys(
+            changed_month
+            for start, end in date_windows
+            for changed_month in self._get_changed_months(start, end)
+        )
+
+        changed = []
+        for start, end in changed_months:
+            for service_account_id in service_account_ids:
+                changed_info = {"start": start}
+                if end:
+                    changed_info["end"] = end
+
+                changed_info["filter"] = {"service_account_id": service_account_id}
+                changed.append(changed_info)
+
+        return changed
+
+    @staticmethod
+    def _get_changed_months(
+        start: str, end: Union[str, None]
+    ) -> List[Tuple[str, Union[str, None]]]:
+        """Map a task window to the billed months its data replaces.
+
+        cost-analysis matches changed against billed_month, so a day-level
+        window becomes one "YYYY-MM" start/end pair per month it touches.
+        Split windows of the same month all map to that month.
+        """
+        if not end:
+            return [(start, None)]
+
+        month_start = datetime.strptime(start[:7], "%Y-%m").date()
+        last_month = end[:7]
+
+        changed_months = []
+        while (month := month_start.strftime("%Y-%m")) <= last_month:
+            changed_months.append((month, month))
+            month_start = (month_start + timedelta(days=32)).replace(day=1)
+
+        return changed_months
+
     @staticmethod
     def __parse_start_time(start_month: str, date_format: str = "%Y-%m"):
         try:
@@ -0,0 +1,174 @@
+"""Tests of the query building in plugin.connector.mimir_connector.
+
+Run from the repository root with the plugin on the path, e.g.
+PYTHONPATH=src python -m pytest test.
+"""
+
+import io
+import json
+
+import pytest
+import requests
+
+from plugin.connector.mimir_connector import MimirConnector
+from plugin.lib.series import Series
+
+_PROMQL = 'sum by (namespace) (opencost_cost{$shard, type="CPU"})'
+
+
+@pytest.mark.parametrize(
+    "promql, query",
+    [
+        (_PROMQL, 'sum by (namespace) (opencost_cost{type="CPU"})'),
+        ("sum(opencost_cost{$shard})", "sum(opencost_cost{})"),
+        ('opencost_cost{type="CPU", $shard}', 'opencost_cost{type="CPU", }'),
+        ("sum(opencost_cost)", "sum(opencost_cost)"),
+    ],
+)
+def test_query_range_params_drop_the_shard_placeholder(promql, query):
+    params = MimirConnector()._make_query_range_params(promql, "1", "2")
+
+    assert params["query"] == query
+
+
+def test_query_shards_substitute_label_matchers():
+    shards = MimirConnector()._make_query_shards(
+        "2024-02",
+        _PROMQL,
+        {"label_matchers": ['cluster="a"', 'cluster!="a"'], "window_days": 15},
+    )
+
+    assert [promql for promql, _, _ in shards] == [
+        'sum by (namespace) (opencost_cost{cluster="a", type="CPU"})',
+        'sum by (namespace) (opencost_cost{cluster!="a", type="CPU"})',
+    ] * 2
+
+
+def test_query_shards_without_label_matchers():
+    shards = MimirConnector()._make_query_shards("2024-02", _PROMQL, {})
+
+    assert {promql for promql, _, _ in shards} == {
+        'sum by (namespace) (opencost_cost{type="CPU"})'
+    }
+
+
+def test_series_count_query_drops_the_shard_placeholder():
+    assert MimirConnector._make_series_count_query(_PROMQL) == (
+        'count by (__tenant_id__) (sum by (namespace) (opencost_cost{type="CPU"}))'
+    )
+
+
+def _make_result(name: str, sample_count: int) -> dict:
+    return {
+        "metric": {"type": "CPU", "pod": name},
+        "values": [[86400 * day, str(day + 1)] for day in range(sample_count)],
+    }
+
+
+def _page_rows(pages: list) -> list:
+    return [
+        [(series.metric["pod"], list(series.costs)) for series in page]
+        for page in pages
+    ]
+
+
+def test_cost_data_pages_split_series_by_rows():
+    pages = list(
+        MimirConnector().get_cost_data(
+            [_make_result("a", 5), _make_result("b", 2), _make_result("c", 1)],
+            max_rows=3,
+        )
+    )
+
+    assert _page_rows(pages) == [
+        [("a", [1.0, 2.0, 3.0])],
+        [("a", [4.0, 5.0]), ("b", [1.0])],
+        [("b", [2.0]), ("c", [1.0])],
+    ]
+
+
+def test_cost_data_pages_by_estimated_bytes():
+    connector = MimirConnector()
+    results = [_make_result("a", 3), _make_result("b", 2)]
+    row_bytes = connector._estimate_row_bytes(Series.from_result(results[0]))
+
+    pages = list(connector.get_cost_data(results, max_bytes=2 * row_bytes))
+
+    assert _page_rows(pages) == [
+        [("a", [1.0, 2.0])],
+        [("a", [3.0]), ("b", [1.0])],
+        [("b", [2.0])],
+    ]
+
+
+def test_cost_data_pages_keep_whole_series_and_oversized_rows():
+    series = Series.from_result(_make_result("a", 2))
+
+    [page] = MimirConnector().get_cost_data([series], max_rows=2)
+    assert page[0] is series
+
+    pages = list(MimirConnector().get_cost_data([series], max_bytes=1))
+    assert _page_rows(pages) == [[("a", [1.0])], [("a", [2.0])]]
+
+
+def test_cost_data_without_series():
+    assert list(MimirConnector().get_cost_data([])) == []
+
+
+def _make_response(status_code: int, body: dict, stream: bool = False):
+    response = requests.Response()
+    response.status_code = status_code
+    if stream:
+        response.raw = io.BytesIO(json.dumps(body).encode())
+    else:
+        response._content = json.dumps(body).encode()
+
+    return response
+
+
+class _ClusterInfoDuringQuerySession:
+    """Answers the first query_range with a query limit error and, while that
+    request is in flight, lets another tenant's cluster info lookup run on the
+    same connector."""
+
+    def __init__(self, connector: MimirConnector):
+        self.connector = connector
+        self.requests = []
+
+    def get(self, url, headers, timeout=None, params=None, stream=False):
+        api_name = url.rsplit("/", 1)[-1]
+        self.requests.append((api_name, headers["X-Scope-OrgID"]))
+
+        if api_name == "query":
+            return _make_response(200, {"data": {"result": [{"metric": {}}]}})
+
+        if len(self.requests) == 1:
+            self.connector.get_kubecost_cluster_info(
+                "http://mimir/api/v1/query",
+                "2024-02",
+                "sa-2",
+                {"cluster_info_query": "kubecost_cluster_info"},
+            )
+            return _make_response(422, {"error": "exceeded the maximum number of"})
+
+        return _make_response(200, {"data": {"result": []}}, stream=stream)
+
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_requests_keep_their_tenant_headers(stream):
+    connector = MimirConnector()
+    connector.session = _ClusterInfoDuringQuerySession(connector)
+    connector.cluster_info_cache_ttl = 0
+    get_response = (
+        connector.stream_promql_response if stream else connector.get_promql_response
+    )
+
+    list(get_response("http://mimir/api/v1/query_range", "2024-02", "sa-1", "cost"))
+
+    assert connector.session.requests == [
+        ("query_range", "sa-1"),
+        ("query", "sa-2"),
+        ("query_range", "sa-1"),
+        ("query_range", "sa-1"),
+    ]
+    assert connector.failed_ranges == []
@@ -0,0 +1,159 @@
+"""Tests of the row reduction and result cache helpers in CostManager.
+
+Run from the repository root with the plugin on the path, e.g.
+PYTHONPATH=src python -m pytest test.
+"""
+
+import math
+from array import array
+from datetime import datetime
+
+import pytest
+
+from plugin.lib.result_cache import ResultCache
+from plugin.lib.series import Series
+from plugin.manager import cost_manager
+from plugin.manager.cost_manager import CostManager
+
+_DAY = 86400
+
+
+def _make_series(metric: dict, samples: list, **kwargs) -> Series:
+    return Series(
+        metric,
+        array("d", [timestamp for timestamp, _ in samples]),
+        array("d", [cost for _, cost in samples]),
+        **kwargs,
+    )
+
+
+def _rows(reduced: list) -> list:
+    return [
+        (series.metric, list(zip(series.timestamps, series.costs)))
+        for series in reduced
+    ]
+
+
+def test_reduce_series_drops_zero_and_nan_costs():
+    reduced = CostManager()._reduce_series(
+        [
+            _make_series(
+                {"type": "CPU", "pod": "a"},
+                [(0, 1.0), (_DAY, 0.0), (2 * _DAY, math.nan), (3 * _DAY, 2.0)],
+            ),
+            _make_series({"type": "RAM", "pod": "a"}, [(0, 0.0), (_DAY, math.nan)]),
+        ],
+        "sa-1",
+    )
+
+    assert _rows(reduced) == [
+        ({"type": "CPU", "pod": "a"}, [(0, 1.0), (3 * _DAY, 2.0)])
+    ]
+
+
+def test_reduce_series_merges_rows_of_the_same_billed_date():
+    cost_manager = CostManager()
+    cost_manager.additional_info_labels = ["namespace"]
+
+    reduced = cost_manager._reduce_series(
+        [
+            _make_series(
+                {"type": "CPU", "namespace": "ns", "pod": "a"},
+                [(0, 1.0), (_DAY, 2.0)],
+            ),
+            _make_series({"type": "RAM", "namespace": "ns", "pod": "a"}, [(0, 4.0)]),
+            # Same namespace, and a later sample of the first UTC day.
+            _make_series(
+                {"type": "CPU", "namespace": "ns", "pod": "b"},
+                [(3600, 0.5), (2 * _DAY, 8.0)],
+            ),
+            _make_series({"type": "CPU", "namespace": "other"}, [(0, 16.0)]),
+        ],
+        "sa-1",
+    )
+
+    assert _rows(reduced) == [
+        (
+            {"type": "CPU", "namespace": "ns", "pod": "a"},
+            [(0, 1.5), (_DAY, 2.0), (2 * _DAY, 8.0)],
+        ),
+        ({"type": "RAM", "namespace": "ns", "pod": "a"}, [(0, 4.0)]),
+        ({"type": "CPU", "namespace": "other"}, [(0, 16.0)]),
+    ]
+
+
+def test_reduce_series_sums_usage_quantities():
+    reduced = CostManager()._reduce_series(
+        [
+            _make_series(
+                {"type": "CPU"},
+                [(0, 1.0), (_DAY, 2.0)],
+                usage_unit="Core-Hours",
+                usage_quantities=array("d", [10.0, 20.0]),
+            ),
+            _make_series(
+                {"type": "CPU"},
+                [(0, 3.0), (_DAY, 0.0)],
+                usage_unit="Core-Hours",
+                usage_quantities=array("d", [30.0, 40.0]),
+            ),
+        ],
+        "sa-1",
+    )
+
+    [series] = reduced
+    assert list(series.costs) == [4.0, 2.0]
+    assert list(series.usage_quantities) == [40.0, 20.0]
+    assert series.usage_unit == "Core-Hours"
+
+
+@pytest.fixture
+def _freeze_utcnow(monkeypatch):
+    class _FrozenDatetime(datetime):
+        @classmethod
+        def utcnow(cls):
+            return datetime(2024, 3, 15, 6, 30)
+
+    monkeypatch.setattr(cost_manager, "datetime", _FrozenDatetime)
+
+
+@pytest.mark.parametrize(
+    "start, end, final",
+    [
+        ("2024-01", None, True),
+        ("2024-02", None, True),
+        ("2024-03", None, False),
+        ("2024-02-01", "2024-02-29", True),
+        ("2024-02-01", "2024-02-20", True),
+        ("2024-02-01", "2024-02-20T12:00:00", True),
+        ("2024-03-01", "2024-03-06", True),
+        ("2024-03-01", "2024-03-07", False),
+        ("2024-01", "2024-02", True),
+    ],
+)
+def test_is_final_window(_freeze_utcnow, start, end, final):
+    assert CostManager._is_final_window(start, end, 8) is final
+
+
+def test_result_cache_key_changes_with_window_and_options(tmp_path):
+    def make_key(end=None, **options):
+        return ResultCache(str(tmp_path)).make_key(
+            "tenant",
+            "http://mimir/prometheus/api/v1/query_range",
+            "sum(node_total_hourly_cost) by (node)",
+            "2024-01-01",
+            end,
+            3600,
+            CostManager._get_result_cache_options(options),
+        )
+
+    keys = {
+        make_key(),
+        make_key("2024-01-15"),
+        make_key(aggregation_level="namespace"),
+        make_key(query_shard={"label_matchers": ['cluster="a"', 'cluster="b"']}),
+    }
+
+    assert len(keys) == 4
+    assert make_key(reduce_rows=True) == make_key()
+    assert make_key(query_shard={"window_days": 7}) == make_key()
@@ -0,0 +1,373 @@
+"""Tests of the task windows and changed ranges built by JobManager.
+
+Run from the repository root with the plugin on the path, e.g.
+PYTHONPATH=src python -m pytest test.
+"""
+
+from datetime import datetime
+
+import pytest
+
+from plugin.manager import job_manager
+from plugin.manager.job_manager import JobManager
+
+
+def _freeze_utcnow(monkeypatch, now: datetime) -> None:
+    class _FrozenDatetime(datetime):
+        @classmethod
+        def utcnow(cls):
+            return now
+
+    monkeypatch.setattr(job_manager, "datetime", _FrozenDatetime)
+
+
+@pytest.fixture
+def manager(monkeypatch):
+    _freeze_utcnow(monkeypatch, datetime(2024, 3, 15, 6, 30))
+    return JobManager()
+
+
+@pytest.mark.parametrize(
+    "last_synchronized_at, lookback_days, windows",
+    [
+        (datetime(2024, 3, 14, 23), 1, [("2024-03", None)]),
+        # The lookback reaches into February, which is fetched as a whole.
+        (datetime(2024, 3, 1, 2), 1, [("2024-02", None), ("2024-03", None)]),
+        (
+            datetime(2024, 3, 10),
+            40,
+            [("2024-01", None), ("2024-02", None), ("2024-03", None)],
+        ),
+        (datetime(2024, 3, 15, 6), 0, [("2024-03", None)]),
+    ],
+)
+def test_incremental_date_windows_cover_whole_months(
+    manager, last_synchronized_at, lookback_days, windows
+):
+    assert (
+        manager._get_incremental_date_windows(
+            last_synchronized_at, {"incremental_lookback_days": lookback_days}
+        )
+        == windows
+    )
+
+
+def test_incremental_sync_changes_whole_months(manager):
+    manager.service_account_names = {"sa-1": "name-sa-1"}
+    agent = {
+        "service_account_id": "sa-1",
+        "state": "ENABLED",
+        "last_accessed_at": "2024-03-15T00:00:00Z",
+        "options": {"cluster_name": "c1"},
+    }
+
+    tasks, changed = manager._get_tasks_by_agents(
+        [agent], None, datetime(2024, 3, 1, 2), {"incremental_sync": True}
+    )
+
+    assert [task["task_options"]["start"] for task in tasks] == ["2024-02", "2024-03"]
+    assert all("end" not in task["task_options"] for task in tasks)
+    assert changed == [
+        {"start": "2024-02", "filter": {"service_account_id": "sa-1"}},
+        {"start": "2024-03", "filter": {"service_account_id": "sa-1"}},
+    ]
+
+
+def _make_agent(service_account_id: str) -> dict:
+    return {
+        "service_account_id": service_account_id,
+        "state": "ENABLED",
+        "last_accessed_at": "2024-03-15T00:00:00Z",
+        "options": {"cluster_name": f"cluster-{service_account_id}"},
+    }
+
+
+@pytest.fixture
+def planning_manager(manager):
+    manager.service_account_names = {
+        "sa-1": "name-sa-1",
+        "sa-2": "name-sa-2",
+        "sa-3": "name-sa-3",
+    }
+    manager.series_counts = {"sa-1": 50000, "sa-2": 1000, "sa-3": 3000}
+    return manager
+
+
+def _changed_months(changed: list) -> list:
+    return [
+        (info["start"], info.get("end"), info["filter"]["service_account_id"])
+        for info in changed
+    ]
+
+
+def test_split_windows_change_their_month_once(planning_manager):
+    tasks, changed = planning_manager._get_tasks_by_agents(
+        [_make_agent("sa-1")],
+        "2024-02",
+        None,
+        {"task_planning": {"series_per_task": 20000}},
+    )
+
+    assert [
+        (task["task_options"]["start"], task["task_options"]["end"]) for task in tasks
+    ] == [
+        ("2024-02-01", "2024-02-09"),
+        ("2024-02-10", "2024-02-19"),
+        ("2024-02-20", "2024-02-29"),
+        ("2024-03-01", "2024-03-05"),
+        ("2024-03-06", "2024-03-10"),
+        ("2024-03-11", "2024-03-15"),
+    ]
+    assert changed == [
+        {
+            "start": "2024-02",
+            "end": "2024-02",
+            "filter": {"service_account_id": "sa-1"},
+        },
+        {
+            "start": "2024-03",
+            "end": "2024-03",
+            "filter": {"service_account_id": "sa-1"},
+        },
+    ]
+
+
+def test_batched_windows_change_every_month_they_cover(planning_manager):
+    tasks, changed = planning_manager._get_tasks_by_agents(
+        [_make_agent("sa-2")],
+        "2023-11",
+        None,
+        {"task_planning": {"series_per_task": 3000}},
+    )
+
+    assert [
+        (task["task_options"]["start"], task["task_options"].get("end"))
+        for task in tasks
+    ] == [
+        ("2023-11-01", "2024-01-31"),
+        ("2024-02", None),
+        ("2024-03", None),
+    ]
+    assert _changed_months(changed) == [
+        ("2023-11", "2023-11", "sa-2"),
+        ("2023-12", "2023-12", "sa-2"),
+        ("2024-01", "2024-01", "sa-2"),
+        ("2024-02", None, "sa-2"),
+        ("2024-03", None, "sa-2"),
+    ]
+
+
+def test_federated_windows_change_every_tenant_per_month(planning_manager):
+    tasks, changed = planning_manager._get_tasks_by_agents(
+        [_make_agent("sa-2"), _make_agent("sa-3")],
+        "2024-01",
+        None,
+        {
+            "tenant_federation": {"series_per_task": 5000},
+            "task_planning": {"series_per_task": 3000},
+        },
+    )
+
+    assert [task["task_options"]["service_account_ids"] for task in tasks] == [
+        ["sa-2", "sa-3"]
+    ] * 6
+    assert _changed_months(changed) == [
+        (month, month, service_account_id)
+        for month in ["2024-01", "2024-02", "2024-03"]
+        for service_account_id in ["sa-2", "sa-3"]
+    ]
+
+
+@pytest.mark.parametrize(
+    "start, end, split_count, sub_windows",
+    [
+        # Leap year February.
+        (
+            "2024-02",
+            None,
+            3,
+            [
+                ("2024-02-01", "2024-02-09"),
+                ("2024-02-10", "2024-02-19"),
+                ("2024-02-20", "2024-02-29"),
+            ],
+        ),
+        (
+            "2023-02",
+            None,
+            2,
+            [("2023-02-01", "2023-02-14"), ("2023-02-15", "2023-02-28")],
+        ),
+        (
+            "2023-12",
+            None,
+            2,
+            [("2023-12-01", "2023-12-15"), ("2023-12-16", "2023-12-31")],
+        ),
+        # The open month ends today.
+        (
+            "2024-03",
+            None,
+            2,
+            [("2024-03-01", "2024-03-07"), ("2024-03-08", "2024-03-15")],
+        ),
+        (
+            "2024-01-30",
+            "2024-02-02",
+            2,
+            [("2024-01-30", "2024-01-31"), ("2024-02-01", "2024-02-02")],
+        ),
+        # More splits than days.
+        (
+            "2024-03-14",
+            "2024-03-15",
+            5,
+            [("2024-03-14", "2024-03-14"), ("2024-03-15", "2024-03-15")],
+        ),
+        ("2024-03-10", "2024-03-31", 1, [("2024-03-10", "2024-03-15")]),
+    ],
+)
+def test_split_date_window(manager, start, end, split_count, sub_windows):
+    assert manager._split_date_window(start, end, split_count) == sub_windows
+
+
+def _month_windows(*months: str) -> list:
+    return [(month, None) for month in months]
+
+
+@pytest.mark.parametrize(
+    "date_windows, batch_size, batched_windows",
+    [
+        (
+            _month_windows(
+                "2023-10", "2023-11", "2023-12", "2024-01", "2024-02", "2024-03"
+            ),
+            2,
+            [
+                ("2023-10-01", "2023-11-30"),
+                ("2023-12-01", "2024-01-31"),
+                ("2024-02", None),
+                ("2024-03", None),
+            ],
+        ),
+        # A batch open at the current month is flushed before it; February of
+        # a leap year ends on the 29th.
+        (
+            _month_windows("2023-12", "2024-01", "2024-02", "2024-03"),
+            4,
+            [("2023-12-01", "2024-02-29"), ("2024-03", None)],
+        ),
+        (
+            _month_windows("2024-02", "2024-03"),
+            12,
+            [("2024-02", None), ("2024-03", None)],
+        ),
+        # Day-level windows are kept and end the batch before them.
+        (
+            [
+                ("2023-12", None),
+                ("2024-01", None),
+                ("2024-02-10", "2024-02-29"),
+                ("2024-03", None),
+            ],
+            3,
+            [
+                ("2023-12-01", "2024-01-31"),
+                ("2024-02-10", "2024-02-29"),
+                ("2024-03", None),
+            ],
+        ),
+        (_month_windows("2024-03"), 2, [("2024-03", None)]),
+    ],
+)
+def test_batch_month_windows(manager, date_windows, batch_size, batched_windows):
+    assert manager._batch_month_windows(date_windows, batch_size) == batched_windows
+
+
+@pytest.mark.parametrize(
+    "series_count, task_planning, planned_windows",
+    [
+        (
+            None,
+            {"series_per_task": 1},
+            _month_windows("2024-01", "2024-02", "2024-03"),
+        ),
+        (
+            30000,
+            {"series_per_task": 20000},
+            [
+                ("2024-01-01", "2024-01-15"),
+                ("2024-01-16", "2024-01-31"),
+                ("2024-02-01", "2024-02-14"),
+                ("2024-02-15", "2024-02-29"),
+                ("2024-03-01", "2024-03-07"),
+                ("2024-03-08", "2024-03-15"),
+            ],
+        ),
+        (
+            20000,
+            {"series_per_task": 20000},
+            _month_windows("2024-01", "2024-02", "2024-03"),
+        ),
+        (
+            5000,
+            {"series_per_task": 20000},
+            [("2024-01-01", "2024-02-29"), ("2024-03", None)],
+        ),
+        (
+            0,
+            {"series_per_task": 20000, "max_months_per_task": 1},
+            _month_windows("2024-01", "2024-02", "2024-03"),
+        ),
+    ],
+)
+def test_plan_date_windows(manager, series_count, task_planning, planned_windows):
+    assert (
+        manager._plan_date_windows(
+            series_count,
+            _month_windows("2024-01", "2024-02", "2024-03"),
+            task_planning,
+        )
+        == planned_windows
+    )
+
+
+def test_group_small_tenants(manager):
+    manager.series_counts = {
+        "sa-1": 4000,
+        "sa-2": 3000,
+        "sa-3": 20000,
+        "sa-4": 2000,
+        "sa-5": 1000,
+        "sa-6": 1000,
+        "sa-7": 500,
+    }
+    inactive_agent = dict(_make_agent("sa-7"), state="DISABLED")
+    agents = [
+        _make_agent("sa-1"),
+        _make_agent("sa-2"),
+        _make_agent("sa-3"),
+        _make_agent("sa-unknown"),
+        _make_agent("sa-4"),
+        inactive_agent,
+        _make_agent("sa-5"),
+        _make_agent("sa-6"),
+        _make_agent("sa-1"),
+    ]
+
+    agent_groups = manager._group_small_tenants(
+        agents, {"series_per_task": 10000, "max_tenants_per_task": 3}
+    )
+
+    assert [
+        [agent["service_account_id"] for agent in agent_group]
+        for agent_group in agent_groups
+    ] == [
+        ["sa-1", "sa-2", "sa-4"],
+        ["sa-3"],
+        ["sa-unknown"],
+        ["sa-7"],
+        ["sa-5", "sa-6"],
+        ["sa-1"],
+    ]
+    assert agent_groups[3] == [inactive_agent]